@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+bench_gen_sqlite_data.py
+
+Benchmarks gen_sqlite_data.py end to end and phase by phase at several population sizes.
+
+Behavior:
+- Scales: "real" (scripts/agent_ssns.json) and synthetic populations such as 10k, 100k, 1m
+  (gen_sqlite_data.iter_synthetic_ssns, the same population as --synthetic).
+- Each scale runs --repeats times, each in a fresh subprocess so peak RSS belongs to that
+  run alone; times and RSS are the median of the runs.
+- Records wall time, peak RSS, output DB size and the generator's per-phase metrics
+  (itineraries, victim_placement, ordering, fly_insert, occupancy, who, name_overrides, who_insert,
+  finalize: time, rows, RNG draws, SQLite statements).
+- Appends every run to a JSON history file and compares it against two baselines: the
+  committed bench_baseline.json, which holds only what does not depend on the machine (DB
+  size and per-phase rows), and a timing baseline recorded on this machine
+  (.bench/baseline.json, --save-baseline). Exits non-zero if any metric regresses past its
+  threshold or a row count changes, or, with --require-baseline, if either baseline is
+  missing.
+- Arguments not recognised here are passed to the generator, e.g.
+  `python3 bench_gen_sqlite_data.py --scales 10k -- --engine numpy --ordering stream`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_PATH = os.path.join(SCRIPT_DIR, ".bench", "history.json")
+# committed: DB size and rows only, comparable on any machine
+BASELINE_PATH = os.path.join(SCRIPT_DIR, "bench_baseline.json")
+# this machine's timings and RSS
+TIMING_BASELINE_PATH = os.path.join(SCRIPT_DIR, ".bench", "baseline.json")
+DEFAULT_SCALES = "real,10k,100k,1m"
+DEFAULT_REPEATS = 3
+# allowed relative increase over the baseline before a metric counts as a regression; the
+# time threshold sits above the run-to-run spread of single runs (20-30%), and times are
+# medians of --repeats runs
+DEFAULT_TIME_THRESHOLD = 0.35
+DEFAULT_RSS_THRESHOLD = 0.15
+DEFAULT_SIZE_THRESHOLD = 0.05
+# timings shorter than this are too noisy to judge (the real roster builds in well under this)
+MIN_COMPARABLE_SECONDS = 0.25
+
+def run_scale(scale, gen_argv):
+    # runs inside the per-scale subprocess; prints one JSON result line
+    sys.path.insert(0, SCRIPT_DIR)
+    import gen_sqlite_data as gen
+
+    args = gen.parse_args(gen_argv + ["--no-cache"])
+    gen.configure(args)
+    if scale == "real":
+        ssns = gen.load_unique_ssns(gen.JSON_PATH)
+    else:
+        # the same counts --synthetic takes
+        ssns = list(gen.iter_synthetic_ssns(gen.parse_count(scale), args.seed))
+
+    inst = gen.BuildInstrumentation(count=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        out_db = os.path.join(tmp, "data.sqlite")
+        started = time.perf_counter()
+        # keep the generator's progress output off our stdout, which carries the result
+        real_stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            gen.build_database(args, ssns, out_db, instrumentation=inst)
+        finally:
+            sys.stdout = real_stdout
+        wall = time.perf_counter() - started
+        db_bytes = os.path.getsize(out_db)
+    print(json.dumps({
+        "agents": len(ssns),
+        "wall_s": wall,
+        "phases_s": {record["phase"]: record["elapsed_s"] for record in inst.records},
+        "phases": inst.records,
+        "peak_rss_mb": gen.peak_rss_mb(),
+        "db_bytes": db_bytes,
+    }))
+
+def measure_once(scale, gen_argv):
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-scale", scale, "--", *gen_argv],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=SCRIPT_DIR,
+    )
+    if proc.returncode != 0:
+        last = proc.stderr.strip().splitlines()[-1:] or [f"exit code {proc.returncode}"]
+        return {"error": last[0]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def measure(scale, gen_argv, repeats=DEFAULT_REPEATS):
+    # median wall, phase times and peak RSS over repeats runs; sizes, rows and counts are
+    # the same in every run
+    runs = []
+    for _ in range(repeats):
+        result = measure_once(scale, gen_argv)
+        if "error" in result:
+            return result
+        runs.append(result)
+    result = dict(runs[0])
+    result["wall_s"] = statistics.median(run["wall_s"] for run in runs)
+    result["wall_runs_s"] = [run["wall_s"] for run in runs]
+    result["phases_s"] = {phase: statistics.median(run["phases_s"][phase] for run in runs)
+                          for phase in result["phases_s"]}
+    result["peak_rss_mb"] = statistics.median(run["peak_rss_mb"] for run in runs)
+    return result
+
+def portable(run):
+    # run without its machine-specific metrics (times, RSS): what bench_baseline.json keeps
+    return {
+        "gen_args": run["gen_args"],
+        "results": {scale: result if "error" in result else {
+            "agents": result["agents"],
+            "db_bytes": result["db_bytes"],
+            "phases": [{"phase": record["phase"], "rows": record["rows"]} for record in result["phases"]],
+        } for scale, result in run["results"].items()},
+    }
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+def compare(run, baseline, args):
+    # returns human-readable regression lines (empty when everything is within thresholds);
+    # only the metrics the baseline holds are compared
+    regressions = []
+
+    def check(label, new, old, threshold, min_old=0.0):
+        if old is None or new is None or old <= min_old:
+            return
+        change = (new - old) / old
+        if change > threshold:
+            regressions.append(f"{label}: {old:.3f} -> {new:.3f} ({change:+.0%}, limit {threshold:+.0%})")
+
+    for scale, result in run["results"].items():
+        base = baseline.get("results", {}).get(scale)
+        if base is None or "error" in result or "error" in base:
+            continue
+        check(f"{scale} wall_s", result["wall_s"], base.get("wall_s"), args.time_threshold, MIN_COMPARABLE_SECONDS)
+        for phase, seconds in result["phases_s"].items():
+            check(f"{scale} {phase}_s", seconds, base.get("phases_s", {}).get(phase), args.time_threshold,
+                  MIN_COMPARABLE_SECONDS)
+        check(f"{scale} peak_rss_mb", result["peak_rss_mb"], base.get("peak_rss_mb"), args.rss_threshold)
+        check(f"{scale} db_bytes", result["db_bytes"], base.get("db_bytes"), args.size_threshold)
+        # rows are deterministic: a change means the generated data changed
+        base_rows = {record["phase"]: record["rows"] for record in base.get("phases", [])}
+        for record in result["phases"]:
+            if record["phase"] in base_rows and record["rows"] != base_rows[record["phase"]]:
+                regressions.append(f"{scale} {record['phase']} rows: {base_rows[record['phase']]} -> {record['rows']}")
+    return regressions
+
+def compare_to_baseline(run, path, args):
+    # prints the comparison against the baseline at path; returns False on a regression, or
+    # on a missing or mismatched baseline with --require-baseline
+    baseline = load_json(path, None)
+    if baseline is None:
+        print(f"No baseline at {path}.")
+        return not args.require_baseline
+    if baseline.get("gen_args") != run["gen_args"]:
+        print(f"Baseline {path} was recorded with generator args {baseline.get('gen_args')}; not comparing.")
+        return not args.require_baseline
+    regressions = compare(run, baseline, args)
+    if regressions:
+        print(f"Regressions against {path}:")
+        for line in regressions:
+            print(f"  {line}")
+        return False
+    print(f"No regressions against {path}.")
+    return True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark gen_sqlite_data.py at several population sizes.")
+    parser.add_argument("--scales", default=DEFAULT_SCALES,
+                        help=f"comma-separated: real, or agent counts like 10k, 250000, 1m (default: {DEFAULT_SCALES})")
+    parser.add_argument("--history", default=HISTORY_PATH, help="JSON file every run is appended to")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS,
+                        help=f"runs per scale; times and RSS are their median (default: {DEFAULT_REPEATS})")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="committed JSON baseline of DB sizes and rows to compare against")
+    parser.add_argument("--timing-baseline", default=TIMING_BASELINE_PATH,
+                        help="JSON baseline of this machine's times and RSS to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store this run as this machine's timing baseline")
+    parser.add_argument("--save-portable-baseline", action="store_true",
+                        help="store this run's DB sizes and rows as the committed baseline")
+    parser.add_argument("--require-baseline", action="store_true",
+                        help="fail when either baseline is missing or was recorded with other generator options (for CI)")
+    parser.add_argument("--time-threshold", type=float, default=DEFAULT_TIME_THRESHOLD)
+    parser.add_argument("--rss-threshold", type=float, default=DEFAULT_RSS_THRESHOLD)
+    parser.add_argument("--size-threshold", type=float, default=DEFAULT_SIZE_THRESHOLD)
+    parser.add_argument("--run-scale", help=argparse.SUPPRESS)
+    args, gen_argv = parser.parse_known_args(argv)
+    if gen_argv[:1] == ["--"]:
+        gen_argv = gen_argv[1:]
+    if args.repeats < 1:
+        parser.error("--repeats must be at least 1")
+
+    if args.run_scale:
+        run_scale(args.run_scale, gen_argv)
+        return
+
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "gen_args": gen_argv,
+        "results": {},
+    }
+    for scale in args.scales.split(","):
+        scale = scale.strip()
+        print(f"[{scale}] running...", flush=True)
+        result = measure(scale, gen_argv, args.repeats)
+        run["results"][scale] = result
+        if "error" in result:
+            print(f"[{scale}] failed: {result['error']}")
+            continue
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result["phases_s"].items())
+        print(f"[{scale}] {result['agents']} agents: {result['wall_s']:.2f}s wall (median of {args.repeats}), "
+              f"{result['peak_rss_mb']:.0f} MB peak RSS, {result['db_bytes'] / 1e6:.1f} MB DB")
+        print(f"[{scale}]   {phases}")
+
+    failed = [scale for scale, result in run["results"].items() if "error" in result]
+    history = load_json(args.history, [])
+    history.append(run)
+    save_json(args.history, history)
+
+    ok = True
+    if args.save_portable_baseline:
+        save_json(args.baseline, portable(run))
+        print(f"Saved DB sizes and rows to {args.baseline}.")
+    else:
+        ok = compare_to_baseline(run, args.baseline, args)
+    if args.save_baseline:
+        save_json(args.timing_baseline, run)
+        print(f"Saved timing baseline to {args.timing_baseline}.")
+    else:
+        ok = compare_to_baseline(run, args.timing_baseline, args) and ok
+    if failed or not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
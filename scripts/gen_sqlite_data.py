@@ -12,19 +12,153 @@ Behavior:
   records are interleaved (not neatly grouped by agent).
 - Adds a special agent (murder victim) with ssn "002-05-1849" generated using the exact
   same itinerary generator as the others, appended after the original agents.
+- Stays are held in memory as typed arrays of city IDs and epoch microseconds (StayStore);
+  city labels and ISO strings are only built by the writers. The jittered sort keeps its
+  keys and agent indexes in typed arrays too and argsorts them (NumPy when available).
+
+Options:
+- --engine python (default): per-agent generator driven by the seeded `random` stream;
+  reproduces the committed static/data.sqlite.
+- --engine numpy: batched generator that draws stays, layovers, hops and travel times for
+  many agents at once as NumPy arrays (same distributions, different random stream).
+  Meant for large synthetic populations; requires numpy.
+- --ordering stream: produce the jittered row order with a bounded k-way merge over the
+  per-agent itineraries, its waiting rows held as typed arrays (spilling sorted runs to
+  disk past --order-window-mb) instead of sorting every row at once.
+- --rng per-agent [--workers N]: each agent's itinerary and who attributes come from an RNG
+  derived from (seed, SSN); agents are generated in shards across N processes and the
+  output is byte-identical for any N.
+- Builds are cached under scripts/.gen_cache, keyed by a fingerprint of the SSN list, the
+  config constants, the options above and this file's source. An unchanged build is copied
+  from the cache; with --rng per-agent, cached agents' itineraries are reused and only new
+  SSNs are generated. That cache is keyed on the itinerary inputs alone (seed, catalog,
+  travel and trip settings, generator code), so other options share it; the
+  CACHE_MAX_DBS builds and CACHE_MAX_ITINERARY_DBS itinerary caches used most recently
+  are kept. --no-cache disables both.
+- --cities PATH loads a city/airport catalog (JSON or CSV) in place of CITIES. Travel times
+  come from a table precomputed once per catalog (computed per hop instead for very large
+  catalogs); --hops nearest picks the next city among the nearest neighbours found with a
+  k-d tree instead of uniformly.
+- --layout optimized targets the in-browser sql.js terminal: cities move to a `city` table,
+  stays to `fly_stay` (agent_id = who.id, city_id, integer epoch seconds) with a
+  (city, arrival) index and an agent index, and `fly` becomes a view with the original
+  column names (ISO text rendered from the epochs) plus arrival_epoch/departure_epoch.
+  Only predicates on the epochs seek by time; ISO predicates seek by city and filter.
+  The file is rewritten at --page-size with ANALYZE and VACUUM.
+- who names and the SEIDPREBW last-initial overrides (NAME_OVERRIDES, or --name-overrides
+  PATH) are resolved on the in-memory records, then written with one bulk insert.
+  --hidden-word WORD instead puts exactly len(WORD) agents at the scene and renames those
+  suspects, whatever their who.ids, so their initials spell WORD in name order; the build
+  fails if they don't.
+- --variants SEEDS|PATH [--jobs N] [--variant-dir DIR] builds one DB per seed or scenario
+  variant in parallel worker processes that share the loaded SSNs and catalog tables, and
+  writes DIR/manifest.json with every variant's checksum and answer key (death city,
+  suspects present at the time of death, hidden word). Variants spell --hidden-word
+  (default SPIDERWEB, or a variants file entry's "word") with their own suspects.
+- --export DIR [--export-format parquet|arrow|csv] streams fly and who into DIR as
+  Parquet or Arrow IPC record batches (pyarrow) or chunked CSV, straight from the rows
+  being inserted.
+- --metrics PATH writes one JSON line per phase (load_ssns, itineraries, victim_placement,
+  ordering, fly_insert, occupancy, who, name_overrides, who_insert, finalize) with elapsed
+  time, rows produced, RNG draws, SQLite statements, peak RSS and the error, if the phase
+  failed (its line is still written); --trace-memory adds
+  tracemalloc peaks, and --profile-phase NAME dumps a cProfile of that phase to --profile-dir.
+- --pipeline hands the build's SQLite connection to a writer thread: the main thread keeps
+  ordering, formatting and generating rows (with --ordering sort, who names and overrides
+  are drawn while the writer drains fly) and queues them in INSERT_CHUNK_ROWS batches (at
+  most PIPELINE_QUEUE_BATCHES waiting, so memory stays bounded) while the writer runs the
+  inserts in the one bulk transaction. The output is identical; the fly_insert to
+  who_insert phase times then measure queueing, finalize waits for the writer, and the
+  writer's CPU time and the producer's time blocked on the queue are printed.
+- --occupancy counts|agents [--occupancy-hours H] adds an `occupancy` table (stays present
+  per city and H-hour bucket) and, with agents, `occupancy_agent` (which agents), both
+  keyed (city, bucket[, agent]) so presence and range queries are primary-key lookups.
+  They are built by a sweep line over the in-memory stays; build time and added size are
+  reported so each deployment can decide whether the rollup pays for itself.
+- --placement solver [--scenario PATH] replaces the victim's retry loop and the presence
+  balancing pass (which regenerates the agents it moves in or out of the scene, pinned
+  with solve_agent_itinerary) with a declarative scenario ("agent A in city C at time T", "between N
+  and M others in C at T") solved in one pass: each constrained agent's itinerary is built
+  around its pinned stays by conditional sampling, so placement cannot fail or retry.
+- --ssns PATH and --out PATH replace the default input and output, which are resolved
+  against this file rather than the working directory. The SSN JSON is read as a stream.
+  --synthetic N replaces it with N unique, validly formatted SSNs drawn per --seed
+  through a keyed permutation of the SSN space (no set of issued SSNs is kept).
+- Builds are written to a temp file and renamed over the output, so readers never see a
+  missing or half-written database.
+- --shards month|city [--shard-dir DIR] also splits the finished database for clients
+  that load it piecemeal: fly goes into one database per arrival month or city (same
+  schema as --layout, fly IDs kept), along with the occupancy rollups of that month or
+  city and, in the optimized layout, the city table and the who rows its fly view needs;
+  who and build_meta go into core.sqlite, and DIR/manifest.json lists each shard's key,
+  ID, arrival and departure ranges, row counts, size and checksum. A client can open the
+  core shard and fetch only the fly shards a query needs.
+- --update (with --rng per-agent, whose builds record their config in a build_meta table)
+  deletes removed agents' rows and inserts added agents' in one transaction on a copy of
+  the existing output, then renames it into place; it falls back to a full build when
+  the seed, options or scenario changed or the scene would be disturbed.
+
+Library use:
+- Importing the module has no side effects: no global seeding (every build seeds its own
+  stream from --seed) and no file access.
+- get_itinerary(ssn, seed) regenerates one agent's stays from its (seed, SSN) stream, as
+  --rng per-agent does, behind a bounded LRU cache; get_itineraries(ssns, seed, workers)
+  does the same for many agents in one pass.
 """
 
+import argparse
+import bisect
+import cProfile
+import csv
+import hashlib
+import heapq
+import inspect
 import json
 import os
+import pickle
+import pstats
+import queue
 import random
+import re
+import shutil
 import sqlite3
 from datetime import datetime, timedelta, timezone
 import math
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice, repeat
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for --engine numpy
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed for Parquet/Arrow --export; CSV works without it
+    pa = pq = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows; peak RSS is then left out of the metrics
+    resource = None
 
 # --- Config ---
-JSON_PATH = "agent_ssns.json"
-OUT_DB = "../static/data.sqlite"
+# default paths are resolved against this file, so the script runs from any directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+JSON_PATH = os.path.join(SCRIPT_DIR, "agent_ssns.json")
+OUT_DB = os.path.join(SCRIPT_DIR, "..", "static", "data.sqlite")
 START = datetime(2025, 9, 1, tzinfo=timezone.utc)
 END = datetime(2025, 11, 13, 14, 59, 59, tzinfo=timezone.utc)
 RANDOM_SEED = 42
@@ -33,6 +167,12 @@ AIRPORT_OVERHEAD_HOURS = 2.0
 MAX_TRIPS_PER_AGENT = 12
 # standard deviation for jitter applied to sort key (in hours)
 SORT_JITTER_HOURS_SD = 48.0
+# stay length distribution and arrival-minute snapping shared by both itinerary engines
+STAY_DAY_CHOICES = [1, 2, 3, 4, 5, 7, 10, 14, 21]
+STAY_DAY_WEIGHTS = [20, 18, 15, 12, 10, 8, 6, 6, 5]
+QUARTER_HOUR_MINUTES = [0, 15, 30, 45]
+# agents per array batch for --engine numpy (bounds peak memory of the (agents, trips) arrays)
+NUMPY_BATCH_AGENTS = 65536
 
 # Murder victim config
 VICTIM_SSN = "002-05-1849"
@@ -42,28 +182,116 @@ VICTIM_DEATH_UTC = datetime(2025, 10, 8, 20, 37, 0, tzinfo=timezone.utc)
 MIN_OTHER_PRESENT = 5
 MAX_OTHER_PRESENT = 10
 
-random.seed(RANDOM_SEED)
+# characters per read while streaming the SSN JSON
+JSON_READ_CHUNK = 1 << 16
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# one or more complete string items, each followed by its comma
+JSON_STRING_RUN = re.compile(r'(?:[ \t\n\r]*"(?:[^"\\]|\\.)*"[ \t\n\r]*,)+')
+# --synthetic population: areas 001-899 except 666, groups 01-99, serials 0001-9999
+SSN_AREAS = [area for area in range(1, 900) if area != 666]
+SSN_GROUPS = 99
+SSN_SERIALS = 9999
 
 # --- Helper utilities ---
-def load_unique_ssns(json_path):
+def iter_json_array(path, chunk_size=JSON_READ_CHUNK):
+    """
+    The items of the top-level JSON array in path, decoded one at a time from chunk_size
+    reads, so a roster never has to be held as one document.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def peek():
+            # next non-whitespace character, reading more as needed ("" at end of file)
+            nonlocal buf, pos, eof
+            while True:
+                pos = JSON_WHITESPACE.match(buf, pos).end()
+                if pos < len(buf) or eof:
+                    return buf[pos:pos + 1]
+                buf, pos = f.read(chunk_size), 0
+                eof = not buf
+
+        if peek() != "[":
+            raise ValueError(f"{path} must be a JSON array")
+        pos += 1
+        if peek() == "]":
+            return
+        while True:
+            run = JSON_STRING_RUN.match(buf, pos)
+            if run:
+                # the common case, a run of complete strings: decoded with one call
+                yield from json.loads(f"[{buf[pos:run.end() - 1]}]")
+                pos = run.end()
+                peek()
+                continue
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # a number cut off by the end of the buffer ("-7.5e|3") may continue in the
+                # next chunk
+                complete = eof or buf[end:].strip("0123456789+-.eE") != ""
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                more = f.read(chunk_size)
+                buf, pos, eof = buf[pos:] + more, 0, not more
+                continue
+            pos = end
+            yield item
+            separator = peek()
+            pos += 1
+            if separator == "]":
+                if peek():
+                    raise ValueError(f"{path}: unexpected data after the array")
+                return
+            if separator != ",":
+                raise ValueError(f"{path}: expected ',' or ']' in the array")
+            peek()
+
+def iter_ssns_json(json_path):
     if not os.path.exists(json_path):
         raise FileNotFoundError(f"Could not find JSON file at: {json_path}")
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    if not isinstance(data, list):
-        raise ValueError("agent_ssns.json must be a JSON array of SSN strings")
-    ssns = []
-    for s in data:
+    for s in iter_json_array(json_path):
         if isinstance(s, str) and s.strip():
-            ssns.append(s.strip())
-    # remove duplicates while preserving order
-    seen = set()
-    ordered_unique = []
-    for s in ssns:
-        if s not in seen:
-            seen.add(s)
-            ordered_unique.append(s)
-    return ordered_unique
+            yield s.strip()
+
+def load_unique_ssns(json_path):
+    # remove duplicates while preserving order; the dict is both the seen-set and the list
+    return list(dict.fromkeys(iter_ssns_json(json_path)))
+
+def synthetic_ssn(index):
+    # mixed-radix decode of an index into the SSN space: (area, group, serial)
+    index, serial = divmod(index, SSN_SERIALS)
+    area, group = divmod(index, SSN_GROUPS)
+    return f"{SSN_AREAS[area]:03d}-{group + 1:02d}-{serial + 1:04d}"
+
+def iter_synthetic_ssns(n, seed=RANDOM_SEED):
+    """
+    n distinct, validly formatted SSNs, deterministic per seed: the first positions of a
+    FeistelPermutation over the whole SSN space, so uniqueness needs no set of the SSNs
+    already produced. The victim's SSN is skipped.
+    """
+    size = len(SSN_AREAS) * SSN_GROUPS * SSN_SERIALS
+    if n >= size:
+        raise ValueError(f"{n} synthetic SSNs requested; the SSN space holds {size - 1}")
+    permutation = FeistelPermutation(size, random.Random(derive_seed(seed, "ssns")))
+    i = 0
+    while n > 0:
+        ssn = synthetic_ssn(permutation(i))
+        i += 1
+        if ssn != VICTIM_SSN:
+            n -= 1
+            yield ssn
+
+def parse_count(text):
+    # "250000", "10k", "1.5m"
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = text[-1:].lower()
+    if suffix in multipliers:
+        return int(float(text[:-1]) * multipliers[suffix])
+    return int(text)
 
 def haversine_km(lat1, lon1, lat2, lon2):
     R = 6371.0
@@ -72,16 +300,48 @@ def haversine_km(lat1, lon1, lat2, lon2):
     a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
     return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1-a))
 
-def estimate_travel_hours(city_a, city_b):
-    d_km = haversine_km(city_a[0], city_a[1], city_b[0], city_b[1])
-    flight_h = d_km / AVG_AIR_KMH
-    jitter = random.uniform(-0.5, 1.5)
-    return max(0.5, flight_h + AIRPORT_OVERHEAD_HOURS + jitter)
+def travel_hours_between(city_a_id, city_b_id, rng=random):
+    # flight time plus airport overhead (a TRAVEL table read) plus jitter, at least half an hour
+    jitter = rng.uniform(-0.5, 1.5)
+    return max(0.5, TRAVEL.hours(city_a_id, city_b_id) + jitter)
+
+def haversine_km_np(lat1, lon1, lat2, lon2):
+    # vectorized haversine_km; arguments in radians
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    return 2 * 6371.0 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
 
 def iso_utc(dt):
     # Return strings like "2025-09-03T13:22:00Z"
     return dt.astimezone(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
 
+# Stays are held internally as integer microseconds since the Unix epoch: exact for
+# datetimes, and ordered, clamped and shifted exactly like the datetimes they replace.
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_us(dt):
+    return (dt - EPOCH) // MICROSECOND
+
+def from_us(us):
+    return EPOCH + us * MICROSECOND
+
+def hours_us(hours):
+    # timedelta(hours=...) in whole microseconds, rounded the way datetime arithmetic rounds
+    return timedelta(hours=hours) // MICROSECOND
+
+@lru_cache(maxsize=None)
+def _iso_day(day):
+    return (EPOCH + timedelta(days=day)).strftime("%Y-%m-%dT")
+
+def iso_utc_seconds(seconds):
+    # iso_utc for epoch seconds, without building a datetime per timestamp
+    day, second = divmod(seconds, 86400)
+    hour, second = divmod(second, 3600)
+    minute, second = divmod(second, 60)
+    return f"{_iso_day(day)}{hour:02d}:{minute:02d}:{second:02d}Z"
+
+START_US, END_US, VICTIM_DEATH_US = to_us(START), to_us(END), to_us(VICTIM_DEATH_UTC)
+
 # --- City list with countries ---
 # (lat, lon, country)
 CITIES = {
@@ -106,264 +366,680 @@ CITIES = {
     "Rome": (41.9028, 12.4964, "Italy"),
     "Seoul": (37.5665, 126.9780, "South Korea")
 }
-CITY_NAMES = list(CITIES.keys())
+
+# travel table layout: catalogs up to EXACT_TRAVEL_MAX_CITIES are filled with the scalar
+# haversine_km (bit-identical to computing it per hop, which the committed dataset relies
+# on), up to DENSE_TRAVEL_MAX_CITIES get one dense float64 NumPy matrix (32 MB at the
+# limit); larger catalogs, or any catalog past the exact limit without numpy, compute each
+# hop on demand from the coordinates, so the table's memory stays linear in the catalog
+EXACT_TRAVEL_MAX_CITIES = 256
+DENSE_TRAVEL_MAX_CITIES = 2048
+# --hops nearest: candidate next cities per city
+DEFAULT_HOP_NEIGHBOURS = 8
+
+def load_city_catalog(path):
+    """
+    Read a city/airport catalog. Accepts JSON, either an object shaped like CITIES
+    ({name: [lat, lon, country]}) or a list of {"name", "lat", "lon", "country"} objects,
+    or CSV with name,lat,lon,country columns. File order defines the city IDs.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            rows = [{"name": name, "lat": v[0], "lon": v[1], "country": v[2] if len(v) > 2 else ""}
+                    for name, v in data.items()]
+        elif isinstance(data, list):
+            rows = data
+        else:
+            raise ValueError("City catalog JSON must be an object or an array")
+    cities = {}
+    for row in rows:
+        name = str(row["name"]).strip()
+        if name in cities:
+            raise ValueError(f"Duplicate city in catalog: {name}")
+        cities[name] = (float(row["lat"]), float(row["lon"]), str(row.get("country") or "").strip())
+    if len(cities) < 2:
+        raise ValueError("City catalog needs at least two cities")
+    return cities
+
+class TravelTable:
+    """Jitter-free travel hours (flight time plus airport overhead) between city IDs."""
+
+    def __init__(self, cities):
+        coords = [(lat, lon) for lat, lon, _ in cities.values()]
+        self.n = len(coords)
+        self._coords = coords
+        self._rows = self._matrix = None
+        if np is not None:
+            self._lat = np.radians([c[0] for c in coords])
+            self._lon = np.radians([c[1] for c in coords])
+        if self.n <= EXACT_TRAVEL_MAX_CITIES:
+            self._rows = [[haversine_km(a[0], a[1], b[0], b[1]) / AVG_AIR_KMH + AIRPORT_OVERHEAD_HOURS
+                           for b in coords] for a in coords]
+            self._matrix = np.array(self._rows) if np is not None else None
+        elif self.n <= DENSE_TRAVEL_MAX_CITIES and np is not None:
+            self._matrix = self._block_hours(0, self.n)
+
+    def _block_hours(self, lo, hi):
+        km = haversine_km_np(self._lat[lo:hi, None], self._lon[lo:hi, None], self._lat[None, :], self._lon[None, :])
+        return km / AVG_AIR_KMH + AIRPORT_OVERHEAD_HOURS
+
+    def hours(self, i, j):
+        if self._rows is not None:
+            return self._rows[i][j]
+        if self._matrix is not None:
+            # item() hands back a Python float, not a boxed NumPy scalar
+            return self._matrix.item(i, j)
+        a, b = self._coords[i], self._coords[j]
+        return haversine_km(a[0], a[1], b[0], b[1]) / AVG_AIR_KMH + AIRPORT_OVERHEAD_HOURS
+
+    def hours_array(self, i, j):
+        # element-wise lookup for NumPy index arrays
+        if self._matrix is not None:
+            return self._matrix[i, j]
+        return haversine_km_np(self._lat[i], self._lon[i], self._lat[j], self._lon[j]) / AVG_AIR_KMH \
+            + AIRPORT_OVERHEAD_HOURS
+
+class CityKDTree:
+    """
+    3-d k-d tree over the catalog's unit vectors. Chord length is monotonic in great-circle
+    distance, so Euclidean nearest neighbours here are the geographically nearest cities.
+    """
+
+    def __init__(self, cities):
+        self._points = []
+        for lat, lon, _ in cities.values():
+            phi, lam = math.radians(lat), math.radians(lon)
+            self._points.append((math.cos(phi)*math.cos(lam), math.cos(phi)*math.sin(lam), math.sin(phi)))
+        self._root = self._build(list(range(len(self._points))), 0)
+
+    def _build(self, ids, depth):
+        if not ids:
+            return None
+        axis = depth % 3
+        ids.sort(key=lambda i: self._points[i][axis])
+        mid = len(ids) // 2
+        return (ids[mid], axis, self._build(ids[:mid], depth + 1), self._build(ids[mid + 1:], depth + 1))
+
+    def nearest(self, city_id, k):
+        # the k nearest other cities, closest first
+        q = self._points[city_id]
+        best = []  # max-heap on distance via negated keys
+
+        def visit(node):
+            if node is None:
+                return
+            i, axis, left, right = node
+            p = self._points[i]
+            d2 = (p[0]-q[0])**2 + (p[1]-q[1])**2 + (p[2]-q[2])**2
+            if i != city_id:
+                if len(best) < k:
+                    heapq.heappush(best, (-d2, -i))
+                elif (-d2, -i) > best[0]:
+                    heapq.heapreplace(best, (-d2, -i))
+            diff = q[axis] - p[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if len(best) < k or diff*diff <= -best[0][0]:
+                visit(far)
+
+        visit(self._root)
+        return [-i for _, i in sorted(best, reverse=True)]
+
+# bumped by every set_city_catalog, so get_itinerary never serves stays from an older catalog
+CATALOG_VERSION = 0
+
+def set_city_catalog(cities, hop_neighbours=0):
+    """
+    Install a city catalog and rebuild everything derived from it: integer IDs, interned
+    labels, the travel table and (hop_neighbours > 0) the nearest-neighbour hop lists.
+    """
+    global CITIES, CITY_NAMES, CITY_IDS, CITY_INDEX, CITY_LABELS, CITY_LABEL_INDEX, TRAVEL, HOP_NEIGHBOURS, \
+        HOP_NEIGHBOUR_COUNT, CATALOG_VERSION
+    CATALOG_VERSION += 1
+    CITIES = cities
+    CITY_NAMES = list(cities.keys())
+    CITY_IDS = range(len(CITY_NAMES))
+    CITY_INDEX = {name: i for i, name in enumerate(CITY_NAMES)}
+    CITY_LABELS = [f"{name}, {country}" if country else name for name, (_, _, country) in cities.items()]
+    CITY_LABEL_INDEX = {label: i for i, label in enumerate(CITY_LABELS)}
+    TRAVEL = TravelTable(cities)
+    HOP_NEIGHBOUR_COUNT = min(hop_neighbours, len(CITY_NAMES) - 1)
+    HOP_NEIGHBOURS = None
+    if HOP_NEIGHBOUR_COUNT > 0:
+        tree = CityKDTree(cities)
+        HOP_NEIGHBOURS = [tree.nearest(i, HOP_NEIGHBOUR_COUNT) for i in CITY_IDS]
 
 def city_label(name):
-    lat, lon, country = CITIES[name]
-    return f"{name}, {country}"
+    return CITY_LABELS[CITY_INDEX[name]]
+
+set_city_catalog(CITIES)
 
 # --- Itinerary generator ---
-def generate_itinerary_for_agent(ssn, start_window_days=10):
+def generate_itinerary_for_agent(ssn, start_window_days=10, rng=random):
     itinerary = []
-    first_arrival = START + timedelta(days=random.uniform(0, start_window_days),
-                                      hours=random.uniform(0, 23),
-                                      minutes=random.choice([0, 15, 30, 45]))
+    first_arrival = START + timedelta(days=rng.uniform(0, start_window_days),
+                                      hours=rng.uniform(0, 23),
+                                      minutes=rng.choice(QUARTER_HOUR_MINUTES))
     if first_arrival > END:
         return itinerary
 
     current_time = first_arrival
-    current_city = random.choice(CITY_NAMES)
+    current_city = rng.choice(CITY_IDS)
     trips_count = 0
 
     while True:
         trips_count += 1
-        stay_days = random.choices(
-            population=[1,2,3,4,5,7,10,14,21],
-            weights=[20,18,15,12,10,8,6,6,5],
+        stay_days = rng.choices(
+            population=STAY_DAY_CHOICES,
+            weights=STAY_DAY_WEIGHTS,
             k=1
         )[0]
-        stay_hours = random.uniform(0, 20)
+        stay_hours = rng.uniform(0, 20)
         departure = current_time + timedelta(days=stay_days, hours=stay_hours)
 
         if departure > END:
             if current_time + timedelta(hours=4) < END:
-                departure = END - timedelta(hours=random.uniform(0, 6))
+                departure = END - timedelta(hours=rng.uniform(0, 6))
             else:
                 break
+            # the trim can land before the arrival; drop the stay rather than end it early
+            if departure <= current_time:
+                break
 
-        itinerary.append((city_label(current_city), current_time, departure))
+        itinerary.append((CITY_LABELS[current_city], current_time, departure))
 
-        next_city = random.choice(CITY_NAMES)
-        attempts = 0
-        while next_city == current_city and attempts < 5:
-            next_city = random.choice(CITY_NAMES)
-            attempts += 1
+        if HOP_NEIGHBOURS is not None:
+            next_city = rng.choice(HOP_NEIGHBOURS[current_city])
+        else:
+            next_city = rng.choice(CITY_IDS)
+            attempts = 0
+            while next_city == current_city and attempts < 5:
+                next_city = rng.choice(CITY_IDS)
+                attempts += 1
 
-        travel_h = estimate_travel_hours(CITIES[current_city], CITIES[next_city])
-        layover_hours = random.uniform(2, 36)
+        travel_h = travel_hours_between(current_city, next_city, rng)
+        layover_hours = rng.uniform(2, 36)
         next_arrival = departure + timedelta(hours=travel_h + layover_hours)
 
         if next_arrival > END or trips_count >= MAX_TRIPS_PER_AGENT:
             break
 
-        next_arrival = next_arrival.replace(minute=random.choice([0,15,30,45]), second=0, microsecond=0)
+        next_arrival = next_arrival.replace(minute=rng.choice(QUARTER_HOUR_MINUTES), second=0, microsecond=0)
         current_city = next_city
         current_time = next_arrival
 
     return itinerary
 
-# --- Main process ---
-def main():
-    try:
-        ssns = load_unique_ssns(JSON_PATH)
-    except Exception as e:
-        print(f"Error loading SSNs: {e}", file=sys.stderr)
-        sys.exit(1)
+# --- Batched NumPy itinerary engine ---
+# Times are float hours since START. Each (agents, MAX_TRIPS_PER_AGENT) array holds one
+# column per trip; `valid` masks out trips that an agent never takes because an earlier
+# trip ran past END.
+def generate_itinerary_batch(n_agents, rng, start_window_days=10):
+    n_cities = len(CITY_NAMES)
+    end_h = (END - START).total_seconds() / 3600.0
+    shape = (n_agents, MAX_TRIPS_PER_AGENT)
+    quarters = np.array(QUARTER_HOUR_MINUTES) / 60.0
+    weights = np.array(STAY_DAY_WEIGHTS, dtype=float)
 
-    if not ssns:
-        print("No SSNs found in JSON. Exiting.", file=sys.stderr)
-        sys.exit(1)
+    # draw every random quantity for every (agent, trip) slot up front
+    stay_h = rng.choice(STAY_DAY_CHOICES, size=shape, p=weights / weights.sum()) * 24.0 \
+        + rng.uniform(0, 20, shape)
+    end_trim_h = rng.uniform(0, 6, shape)
+    if HOP_NEIGHBOURS is not None:
+        neighbours = np.array(HOP_NEIGHBOURS, dtype=np.int32)
+        hop = rng.integers(0, HOP_NEIGHBOUR_COUNT, shape)
+    else:
+        # offset 1..n-1 from the current city, so the next city always differs
+        hop = rng.integers(1, n_cities, shape)
+    travel_jitter_h = rng.uniform(-0.5, 1.5, shape)
+    layover_h = rng.uniform(2, 36, shape)
+    snap_h = rng.choice(quarters, shape)
 
-    print(f"Found {len(ssns)} unique SSN(s). Generating itineraries...")
+    cur_city = rng.integers(0, n_cities, n_agents)
+    cur = rng.uniform(0, start_window_days, n_agents) * 24.0 + rng.uniform(0, 23, n_agents) \
+        + rng.choice(quarters, n_agents)
+    alive = cur <= end_h
 
-    # Build rows with datetime objects (not yet ISO strings), so we can compute jittered sort keys
-    rows_dt = []  # entries: (agent_ssn, city_str, arrival_dt, departure_dt)
-    for ssn in ssns:
-        itin = generate_itinerary_for_agent(ssn)
-        if not itin:
-            fallback_arr = START + timedelta(days=random.uniform(0, 3), hours=random.uniform(6, 20))
-            fallback_dep = min(END, fallback_arr + timedelta(days=1, hours=random.uniform(0, 12)))
-            city = city_label(random.choice(CITY_NAMES))
-            rows_dt.append((ssn, city, fallback_arr, fallback_dep))
+    city = np.zeros(shape, dtype=np.int32)
+    arrival = np.zeros(shape)
+    departure = np.zeros(shape)
+    valid = np.zeros(shape, dtype=bool)
+    for t in range(MAX_TRIPS_PER_AGENT):
+        dep = cur + stay_h[:, t]
+        over = dep > end_h
+        # a stay running past END is cut short if there are still 4h left (and the cut
+        # leaves it after its arrival), else dropped
+        trimmed = over & (cur + 4 < end_h)
+        dep = np.where(trimmed, end_h - end_trim_h[:, t], dep)
+        ok = alive & ~(over & ~trimmed) & (dep > cur)
+
+        city[:, t] = cur_city
+        arrival[:, t] = cur
+        departure[:, t] = dep
+        valid[:, t] = ok
+
+        if HOP_NEIGHBOURS is not None:
+            next_city = neighbours[cur_city, hop[:, t]]
         else:
-            for city, arr, dep in itin:
-                rows_dt.append((ssn, city, arr, dep))
-
-    # --- Build agent -> sorted itinerary mapping so we can modify safely ---
-    agent_itins = {}
-    for agent_ssn, city, arr_dt, dep_dt in rows_dt:
-        agent_itins.setdefault(agent_ssn, []).append((city, arr_dt, dep_dt))
-    # sort each agent's itinerary by arrival time
-    for ssn in agent_itins:
-        agent_itins[ssn].sort(key=lambda t: t[1])
-
-    # Choose a death city for the victim
-    death_city_name = random.choice(CITY_NAMES)
-    death_city_label = city_label(death_city_name)
-    print(f"Chosen death city: {death_city_label}")
-
-    # Count how many other agents already present in that city at the death time
-    def present_in_city_at(agent_entries, city_label_str, dt):
-        for c, a, d in agent_entries:
-            if c == city_label_str and a <= dt < d:
-                return True
-        return False
+            next_city = (cur_city + hop[:, t]) % n_cities
+        travel = np.maximum(0.5, TRAVEL.hours_array(cur_city, next_city) + travel_jitter_h[:, t])
+        next_arrival = dep + travel + layover_h[:, t]
+        alive = ok & (next_arrival <= end_h)
+        # START is on the hour, so flooring hours-since-START snaps to the wall-clock hour
+        cur = np.floor(next_arrival) + snap_h[:, t]
+        cur_city = next_city
+
+    return city, arrival, departure, valid
+
+def batch_to_itineraries(batch):
+    city, arrival, departure, valid = batch
+    labels = CITY_LABELS
+    counts = valid.sum(axis=1)
+    for i in range(city.shape[0]):
+        n = counts[i]
+        yield [(labels[c], START + timedelta(hours=float(a)), START + timedelta(hours=float(d)))
+               for c, a, d in zip(city[i, :n].tolist(), arrival[i, :n].tolist(), departure[i, :n].tolist())]
+
+def iter_numpy_itineraries(n_agents, rng, batch_agents=NUMPY_BATCH_AGENTS):
+    # yields one itinerary (same tuple layout as generate_itinerary_for_agent) per agent
+    while n_agents > 0:
+        n = min(n_agents, batch_agents)
+        yield from batch_to_itineraries(generate_itinerary_batch(n, rng))
+        n_agents -= n
+
+# --- Compact stay store ---
+class StayStore(MutableMapping):
+    """
+    Every agent's stays in parallel typed arrays: city ID, arrival and departure in epoch
+    microseconds (see to_us), with agent i's stays in rows _start[i]:_start[i + 1], sorted
+    by arrival. About 18 bytes per stay instead of a tuple of a label and two datetimes.
+
+    It is a mapping SSN -> [(city_id, arrival_us, departure_us)] in insertion order, so
+    the placement passes read and replace agents as before; a replaced agent's stays live
+    in a small side table, since placement only ever rewrites a handful of agents.
+    Labels and ISO strings are produced only by the writers.
+    """
+
+    def __init__(self):
+        self._ssns = []
+        self._ids = {}
+        self._start = array("q", [0])
+        self.city = array("H" if len(CITY_LABELS) <= 0xFFFF else "I")
+        self.arrival = array("q")
+        self.departure = array("q")
+        self._replaced = {}  # agent id -> stays replacing its rows
+
+    def add(self, ssn, itinerary):
+        # append (label, arrival, departure) stays from a generator, merged by arrival
+        stays = [(CITY_LABEL_INDEX[city], to_us(arr), to_us(dep)) for city, arr, dep in itinerary]
+        if ssn in self._ids:
+            stays = self[ssn] + stays
+        stays.sort(key=itemgetter(1))
+        self[ssn] = stays
+
+    def __setitem__(self, ssn, stays):
+        agent = self._ids.get(ssn)
+        if agent is not None:
+            self._replaced[agent] = list(stays)
+            return
+        self._ids[ssn] = len(self._ssns)
+        self._ssns.append(ssn)
+        for city, arr, dep in stays:
+            self.city.append(city)
+            self.arrival.append(arr)
+            self.departure.append(dep)
+        self._start.append(len(self.arrival))
+
+    def __getitem__(self, ssn):
+        agent = self._ids[ssn]
+        if agent in self._replaced:
+            return list(self._replaced[agent])
+        rows = range(self._start[agent], self._start[agent + 1])
+        return [(self.city[i], self.arrival[i], self.departure[i]) for i in rows]
+
+    def columns(self, ssn):
+        # (cities, arrivals, departures, start, stop): ssn's stays are rows start:stop of the
+        # three parallel sequences, the store's own arrays unless the agent was replaced
+        agent = self._ids[ssn]
+        if agent in self._replaced:
+            stays = self._replaced[agent]
+            return ([c for c, _, _ in stays], [a for _, a, _ in stays], [d for _, _, d in stays],
+                    0, len(stays))
+        return self.city, self.arrival, self.departure, self._start[agent], self._start[agent + 1]
+
+    def __delitem__(self, ssn):
+        raise TypeError("agents cannot be removed from a StayStore")
+
+    def __contains__(self, ssn):
+        return ssn in self._ids
+
+    def __iter__(self):
+        return iter(self._ssns)
+
+    def __len__(self):
+        return len(self._ssns)
+
+    def stay_count(self):
+        return len(self.arrival) + sum(len(stays) - (self._start[agent + 1] - self._start[agent])
+                                       for agent, stays in self._replaced.items())
+
+    def city_stays(self, city):
+        # [(arrival, departure, ssn)] of every current stay in city
+        if np is not None:
+            rows = np.flatnonzero(np.frombuffer(self.city, dtype=self.city.typecode) == city).tolist()
+        else:
+            rows = [i for i, c in enumerate(self.city) if c == city]
+        stays = []
+        for i in rows:
+            agent = bisect.bisect_right(self._start, i) - 1
+            if agent not in self._replaced:
+                stays.append((self.arrival[i], self.departure[i], self._ssns[agent]))
+        for agent, replaced in self._replaced.items():
+            stays.extend((arr, dep, self._ssns[agent]) for c, arr, dep in replaced if c == city)
+        return stays
+
+# --- City presence index ---
+class CityPresenceIndex:
+    """
+    Per-city sorted interval index over a StayStore's stays (city IDs, microsecond times),
+    answering "who was in city X at time T".
+
+    A stay (arrival, departure) contains T when arrival <= T < departure, matching the
+    generator's presence rule. Counts are two binary searches (stays started by T minus
+    stays ended by T); agent lookups scan only the stays that started within the city's
+    longest stay before T. A city is indexed from the store the first time it is queried,
+    so only the few cities placement looks at are ever indexed; updates to cities not yet
+    indexed are skipped, as the store already holds them.
+    """
+
+    def __init__(self, store=None):
+        self._store = store
+        self._stays = {}     # city -> [(arrival, departure, ssn)] sorted
+        self._ends = {}      # city -> [departure] sorted
+        self._max_len = {}   # city -> longest stay duration ever indexed
+
+    def _city(self, city):
+        stays = self._stays.get(city)
+        if stays is None:
+            stays = [s for s in self._store.city_stays(city) if s[0] < s[1]] if self._store is not None else []
+            stays.sort()
+            self._stays[city] = stays
+            self._ends[city] = sorted(dep for _, dep, _ in stays)
+            self._max_len[city] = max((dep - arr for arr, dep, _ in stays), default=0)
+        return stays
+
+    def add_stay(self, ssn, city, arr, dep):
+        # empty stays can never contain a point in time; unindexed cities read the store later
+        if not arr < dep or city not in self._stays:
+            return
+        bisect.insort(self._stays[city], (arr, dep, ssn))
+        bisect.insort(self._ends[city], dep)
+        self._max_len[city] = max(self._max_len[city], dep - arr)
+
+    def remove_stay(self, ssn, city, arr, dep):
+        if not arr < dep or city not in self._stays:
+            return
+        stays = self._stays[city]
+        del stays[bisect.bisect_left(stays, (arr, dep, ssn))]
+        ends = self._ends[city]
+        del ends[bisect.bisect_left(ends, dep)]
+
+    def replace_agent(self, ssn, old_entries, new_entries):
+        for city, arr, dep in old_entries:
+            self.remove_stay(ssn, city, arr, dep)
+        for city, arr, dep in new_entries:
+            self.add_stay(ssn, city, arr, dep)
+
+    def count_present(self, city, t):
+        stays = self._city(city)
+        if not stays:
+            return 0
+        started = bisect.bisect_right(stays, t, key=itemgetter(0))
+        return started - bisect.bisect_right(self._ends[city], t)
+
+    def _candidates(self, city, t):
+        stays = self._city(city)
+        if not stays:
+            return []
+        lo = bisect.bisect_right(stays, t - self._max_len[city], key=itemgetter(0))
+        hi = bisect.bisect_right(stays, t, key=itemgetter(0))
+        return [s for s in stays[lo:hi] if t < s[1]]
+
+    def agents_present(self, city, t):
+        return {ssn for _, _, ssn in self._candidates(city, t)}
+
+    def is_present(self, ssn, city, t):
+        return any(s == ssn for _, _, s in self._candidates(city, t))
+
+# --- WHO table data ---
+FIRST_NAMES = ["Alex", "Jamie", "Taylor", "Jordan", "Casey", "Morgan", "Avery", "Riley", "Parker", "Quinn",
+               "Sam", "Charlie", "Cameron", "Drew", "Rowan", "Reese", "Hayden", "Kai", "Sasha", "Elliot",
+               "Noah", "Liam", "Mason", "Ethan", "Logan", "Lucas", "Oliver", "Aiden", "Carter", "Grayson",
+               "Hannah", "Olivia", "Emma", "Ava", "Isabella", "Sophia", "Mia", "Charlotte", "Amelia", "Harper",
+               "Benjamin", "William", "James", "Henry", "Jacob", "Michael", "Daniel", "Matthew", "Joseph", "David",
+               "Zoe", "Chloe", "Lily", "Madison", "Emily", "Aria", "Scarlett", "Victoria", "Grace", "Nora",
+               "Ian", "Victor", "Gabe", "Marcus", "Leo", "Felix", "Simon", "Owen", "Evan", "Adam",
+               "Brandon", "Natalie", "Ruby", "Josie", "Maya", "Ivy", "Alice", "Elsa", "Irene", "June"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Miller", "Davis", "Garcia", "Rodriguez", "Wilson",
+              "Martinez", "Anderson", "Taylor", "Thomas", "Hernandez", "Moore", "Martin", "Jackson", "Thompson", "White",
+              "Lopez", "Lee", "Gonzalez", "Harris", "Clark", "Lewis", "Robinson", "Ingraham", "Walker", "Perez", "Hall",
+              "Young", "Allen", "Sanchez", "Wright", "King", "Scott", "Green", "Baker", "Adams", "Nelson", "Irving",
+              "Hill", "Ramirez", "Campbell", "Mitchell", "Roberts", "Carter", "Phillips", "Evans", "Turner", "Torres",
+              "Parker", "Collins", "Edwards", "Stewart", "Flores", "Morris", "Nguyen", "Murphy", "Rivera", "Cook",
+              "Rogers", "Morgan", "Peterson", "Cooper", "Reed", "Bailey", "Bell", "Gomez", "Kelly", "Howard",
+              "Ward", "Cox", "Diaz", "Richardson", "Wood", "Watson", "Brooks", "Bennett", "Gray", "James",
+              "Reyes", "Cruz", "Hughes", "Price", "Myers", "Long", "Foster", "Sanders", "Ross", "Morales"]
+EYE_COLORS = ["brown", "blue", "green", "hazel", "gray", "amber"]
+# populations larger than FIRST_NAMES x LAST_NAMES draw from "First M. Last", then with
+# suffixes, then "First M. N. Last Suffix"; NAME_TIERS is (middle options, suffix options)
+MIDDLE_INITIALS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+NAME_SUFFIXES = ["Jr.", "Sr.", "II", "III", "IV"]
+NAME_TIERS = [(1 + len(MIDDLE_INITIALS), 1),
+              (1 + len(MIDDLE_INITIALS), 1 + len(NAME_SUFFIXES)),
+              (1 + len(MIDDLE_INITIALS) + len(MIDDLE_INITIALS) ** 2, 1 + len(NAME_SUFFIXES))]
+
+# who.id values whose last-name initials spell the part 2 answer, in order
+OVERRIDE_TARGET_IDS = [287, 280, 40, 290, 225, 79, 254, 46, 211]
+OVERRIDE_TARGET_WORD = "SEIDPREBW"  # letters to match
+# who.id -> name constraint, applied in order before the who insert (see apply_name_overrides)
+NAME_OVERRIDES = {row_id: {"initial": letter}
+                  for row_id, letter in zip(OVERRIDE_TARGET_IDS, OVERRIDE_TARGET_WORD, strict=True)}
+# the part 2 answer (suspects' last-name initials in name order) that --variants builds spell
+HIDDEN_WORD = "SPIDERWEB"
+
+# agents per process-pool task for --rng per-agent
+AGENT_SHARD_SIZE = 2048
+# agents whose stays get_itinerary keeps
+ITINERARY_CACHE_SIZE = 4096
+# content-addressed build cache (see build_fingerprint); keeps this many finished DBs
+CACHE_DIR = os.path.join(SCRIPT_DIR, ".gen_cache")
+CACHE_MAX_DBS = 8
+# per-agent itinerary caches (one per itinerary_fingerprint) kept, least recently used evicted
+CACHE_MAX_ITINERARY_DBS = 4
+# rows per executemany call while streaming into SQLite
+INSERT_CHUNK_ROWS = 10000
+# --pipeline: INSERT_CHUNK_ROWS batches queued for the writer thread before the producer waits
+PIPELINE_QUEUE_BATCHES = 8
+# --ordering stream: jitter is truncated at this many SDs, which bounds how far a row can
+# move and therefore how long the merge has to hold it
+SORT_JITTER_WINDOW_SDS = 6.0
+# bytes of typed arrays the streaming merge's window may hold before it spills sorted runs
+# to disk (a waiting row is a key, an agent index and a row offset: 20 bytes)
+ORDER_WINDOW_MAX_BYTES = 64 * 2**20
+# rows the window gathers, at least, between sorts
+ORDER_WINDOW_MIN_SORT_ROWS = 4096
+# rows per pickle record in a spilled run
+SPILL_BLOCK_ROWS = 4096
+
+# --- Pipeline stages ---
+def fallback_stays(rng=random):
+    # a single short stay for agents whose generated itinerary came out empty
+    fallback_arr = START + timedelta(days=rng.uniform(0, 3), hours=rng.uniform(6, 20))
+    fallback_dep = min(END, fallback_arr + timedelta(days=1, hours=rng.uniform(0, 12)))
+    city = city_label(rng.choice(CITY_NAMES))
+    return [(city, fallback_arr, fallback_dep)]
+
+def generate_agent_stays(ssn, rng=random):
+    return generate_itinerary_for_agent(ssn, rng=rng) or fallback_stays(rng)
+
+def derive_seed(*parts):
+    # stable 64-bit seed from (seed, stream name, ssn, ...), independent of PYTHONHASHSEED
+    digest = hashlib.sha256(":".join(str(p) for p in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def agent_rng(seed, ssn, stream="itinerary"):
+    return random.Random(derive_seed(seed, stream, ssn))
+
+def _generate_agent_shard(seed, ssns):
+    # process-pool task: one agent's stays depend only on (seed, ssn), never on the shard layout
+    return [generate_agent_stays(ssn, agent_rng(seed, ssn)) for ssn in ssns]
+
+def iter_per_agent_itineraries(ssns, seed, workers=1, shard_size=AGENT_SHARD_SIZE):
+    shards = [ssns[i:i + shard_size] for i in range(0, len(ssns), shard_size)]
+    if workers <= 1:
+        for shard in shards:
+            yield from _generate_agent_shard(seed, shard)
+        return
+    # workers rebuild the catalog-derived tables, in case it was replaced via --cities
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_city_catalog,
+                             initargs=(CITIES, HOP_NEIGHBOUR_COUNT)) as pool:
+        # map() returns shards in submission order, so output is independent of scheduling
+        for itins in pool.map(_generate_agent_shard, repeat(seed), shards):
+            yield from itins
 
-    present_agents = [ssn for ssn, entries in agent_itins.items() if present_in_city_at(entries, death_city_label, VICTIM_DEATH_UTC)]
-    present_count = len([a for a in present_agents if a != VICTIM_SSN])  # exclude victim if present (shouldn't be)
+# --- On-demand itinerary lookup ---
+class ItineraryCache:
+    """A bounded mapping that drops the least recently used entry once it is full."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        stays = self._entries.get(key)
+        if stays is not None:
+            self._entries.move_to_end(key)
+        return stays
+
+    def put(self, key, stays):
+        self._entries[key] = stays
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+ITINERARY_CACHE = ItineraryCache(ITINERARY_CACHE_SIZE)
+
+def get_itinerary(ssn, seed=RANDOM_SEED):
+    """
+    One agent's stays, [(label, arrival, departure)] sorted by arrival, regenerated from
+    the agent's own (seed, SSN) stream without building anything else. These are the
+    stays --rng per-agent starts from for that seed; the placement passes later rewrite a
+    few agents (the victim and the agents moved in or out of the death city).
+    """
+    key = (CATALOG_VERSION, seed, ssn)
+    stays = ITINERARY_CACHE.get(key)
+    if stays is None:
+        stays = tuple(generate_agent_stays(ssn, agent_rng(seed, ssn)))
+        ITINERARY_CACHE.put(key, stays)
+    return list(stays)
+
+def get_itineraries(ssns, seed=RANDOM_SEED, workers=1):
+    # get_itinerary for many agents: {ssn: stays}; agents not in the cache are generated in
+    # one pass, sharded over `workers` processes
+    found = {}
+    missing = []
+    for ssn in dict.fromkeys(ssns):
+        stays = ITINERARY_CACHE.get((CATALOG_VERSION, seed, ssn))
+        if stays is None:
+            missing.append(ssn)
+        else:
+            found[ssn] = stays
+    for ssn, stays in zip(missing, iter_per_agent_itineraries(missing, seed, workers)):
+        found[ssn] = tuple(stays)
+        ITINERARY_CACHE.put((CATALOG_VERSION, seed, ssn), found[ssn])
+    return {ssn: list(found[ssn]) for ssn in ssns}
+
+def build_agent_itineraries(ssns, itineraries):
+    # agent -> stays sorted by arrival, encoded into a compact StayStore as they arrive
+    agent_itins = StayStore()
+    for ssn, itin in zip(ssns, itineraries):
+        agent_itins.add(ssn, itin)
+    return agent_itins
+
+def balance_death_city_presence(agent_itins, presence, death_city, rng=random,
+                                min_present=MIN_OTHER_PRESENT, max_present=MAX_OTHER_PRESENT):
+    # Count how many other agents already present in that city at the death time.
+    # The index is kept in sync with every rewrite below so each pass queries it instead
+    # of rescanning every itinerary. Stays are StayStore entries (city ID, epoch us).
+    death_city_label = CITY_LABELS[death_city]
+    present_agents = presence.agents_present(death_city, VICTIM_DEATH_US) - {VICTIM_SSN}
+    present_count = len(present_agents)
     print(f"Initially {present_count} agents present at {death_city_label} at {VICTIM_DEATH_UTC.isoformat()} UTC")
 
-    # If fewer than MIN_OTHER_PRESENT, insert stays for randomly chosen agents so they ARE present
-    if present_count < MIN_OTHER_PRESENT:
-        need = MIN_OTHER_PRESENT - present_count
-        # choose candidate agents that are not already present and not the victim
+    # Agents are moved in or out by regenerating their whole itinerary pinned to (or kept
+    # out of) the death city at the death time, so the new stays follow the generator's
+    # travel, layover and no-overlap rules instead of being patched in place.
+    scene = [(death_city, VICTIM_DEATH_UTC)]
+    if present_count < min_present:
         candidates = [ssn for ssn in agent_itins.keys() if ssn != VICTIM_SSN and ssn not in present_agents]
-        random.shuffle(candidates)
-        added = 0
-        for ssn in candidates:
-            if added >= need:
-                break
-            entries = agent_itins[ssn]
-            # Remove any entries that strictly contain the death time (shouldn't be, candidate list filtered),
-            # but also remove overlapping entries to avoid inconsistencies.
-            new_entries = [e for e in entries if not (e[1] < VICTIM_DEATH_UTC and VICTIM_DEATH_UTC < e[2])]
-            # Create a new stay that definitely spans the death time
-            pre_hours = random.uniform(6, 48)
-            post_hours = random.uniform(6, 48)
-            arr = max(START, VICTIM_DEATH_UTC - timedelta(hours=pre_hours))
-            dep = min(END, VICTIM_DEATH_UTC + timedelta(hours=post_hours))
-            new_entries.append((death_city_label, arr, dep))
-            # sort and then avoid consecutive identical cities by patching neighbors
-            new_entries.sort(key=lambda t: t[1])
-            # ensure no consecutive identical-city stays
-            patched = []
-            for city, a, d in new_entries:
-                if patched and patched[-1][0] == city:
-                    # change city to some other city to avoid duplicate consecutive city
-                    alt_c = city
-                    attempts = 0
-                    while alt_c == city and attempts < 10:
-                        alt_choice = random.choice(CITY_NAMES)
-                        alt_c = city_label(alt_choice)
-                        attempts += 1
-                    city = alt_c
-                patched.append((city, a, d))
-            agent_itins[ssn] = patched
-            added += 1
-        present_count += added
-        print(f"Added {added} agents to reach {present_count} present.")
-
-    # If more than MAX_OTHER_PRESENT, remove some presence by altering some agents' entries at that time
-    if present_count > MAX_OTHER_PRESENT:
-        # find which agents are present (exclude victim)
-        present_list = [ssn for ssn in agent_itins if present_in_city_at(agent_itins[ssn], death_city_label, VICTIM_DEATH_UTC)]
-        present_list = [s for s in present_list if s != VICTIM_SSN]
-        remove_needed = present_count - MAX_OTHER_PRESENT
-        random.shuffle(present_list)
-        removed = 0
-        for ssn in present_list:
-            if removed >= remove_needed:
-                break
-            entries = agent_itins[ssn]
-            new_entries = []
-            for city, a, d in entries:
-                if city == death_city_label and a <= VICTIM_DEATH_UTC < d:
-                    # change this stay to another city that isn't equal to neighbor city
-                    alt_city = death_city_label
-                    attempts = 0
-                    while alt_city == death_city_label and attempts < 20:
-                        alt_choice = random.choice(CITY_NAMES)
-                        alt_city = city_label(alt_choice)
-                        attempts += 1
-                    new_entries.append((alt_city, a, d))
-                    removed += 1
-                else:
-                    new_entries.append((city, a, d))
-            # fix consecutive duplicates
-            patched = []
-            for city, a, d in new_entries:
-                if patched and patched[-1][0] == city:
-                    alt_city = city
-                    attempts = 0
-                    while alt_city == city and attempts < 20:
-                        alt_city = city_label(random.choice(CITY_NAMES))
-                        attempts += 1
-                    city = alt_city
-                patched.append((city, a, d))
-            agent_itins[ssn] = patched
-        present_count -= removed
-        print(f"Removed presence from {removed} agents to reach {present_count} present.")
-
-    # At this point, ensure present_count is within [MIN_OTHER_PRESENT, MAX_OTHER_PRESENT]
-    # If still not enough (edge cases), we'll try one more pass inserting for random agents
-    if present_count < MIN_OTHER_PRESENT:
-        candidates = [ssn for ssn in agent_itins.keys() if ssn != VICTIM_SSN and not present_in_city_at(agent_itins[ssn], death_city_label, VICTIM_DEATH_UTC)]
-        random.shuffle(candidates)
-        added = 0
-        for ssn in candidates:
-            if present_count >= MIN_OTHER_PRESENT:
-                break
-            entries = agent_itins[ssn]
-            # Insert a short stay spanning the death time
-            arr = max(START, VICTIM_DEATH_UTC - timedelta(hours=8))
-            dep = min(END, VICTIM_DEATH_UTC + timedelta(hours=8))
-            entries.append((death_city_label, arr, dep))
-            entries.sort(key=lambda t: t[1])
-            # fix duplicates
-            patched = []
-            for city, a, d in entries:
-                if patched and patched[-1][0] == city:
-                    alt_city = city
-                    attempts = 0
-                    while alt_city == city and attempts < 10:
-                        alt_city = city_label(random.choice(CITY_NAMES))
-                        attempts += 1
-                    city = alt_city
-                patched.append((city, a, d))
-            agent_itins[ssn] = patched
-            present_count += 1
-            added += 1
-        print(f"Final pass added {added} agents; now {present_count} present.")
-
-    print(f"Final count present at death: {present_count} (target between {MIN_OTHER_PRESENT} and {MAX_OTHER_PRESENT})")
+        need, step, pins, avoid, verb = min_present - present_count, 1, scene, (), "Added"
+    elif present_count > max_present:
+        candidates = [ssn for ssn in agent_itins.keys() if ssn in present_agents]
+        need, step, pins, avoid, verb = present_count - max_present, -1, (), scene, "Removed presence from"
+    else:
+        candidates, need = [], 0
+    rng.shuffle(candidates)
+    moved = 0
+    for ssn in candidates:
+        if moved >= need:
+            break
+        try:
+            entries = solve_agent_itinerary(pins, avoid, rng)
+        except ValueError:
+            continue
+        presence.replace_agent(ssn, agent_itins[ssn], entries)
+        agent_itins[ssn] = entries
+        moved += 1
+    if need:
+        present_count += step * moved
+        print(f"{verb} {moved} agents to reach {present_count} present.")
+
+    print(f"Final count present at death: {present_count} (target between {min_present} and {max_present})")
+    return present_count
 
+def place_victim(agent_itins, presence, death_city, victim_candidates, rng=random):
     # --- Generate the victim's itinerary using the SAME generator as other agents ---
     # Attempt multiple times (advancing RNG each try) until the generated itinerary naturally
     # contains at least one stay that spans VICTIM_DEATH_UTC. This keeps generation identical
     # in method to other agents; we only repeat generation until we get an itinerary that fits.
+    death_city_label = CITY_LABELS[death_city]
     victim_itin = []
-    max_attempts = 500
     attempts = 0
-    while attempts < max_attempts:
+    for gen in victim_candidates:
         attempts += 1
-        gen = generate_itinerary_for_agent(VICTIM_SSN)
+        gen = [(CITY_LABEL_INDEX[c], to_us(a), to_us(d)) for c, a, d in gen]
         # check if any stay in gen is in the chosen death city and spans the death time
-        spans_in_death_city = [1 for (c, a, d) in gen if c == death_city_label and a <= VICTIM_DEATH_UTC < d]
+        spans_in_death_city = [1 for (c, a, d) in gen if c == death_city and a <= VICTIM_DEATH_US < d]
         if spans_in_death_city:
             victim_itin = gen
             print(f"Victim itinerary found after {attempts} generate attempts (natural span in {death_city_label}).")
             break
         # else continue to next attempt (this advances RNG)
-    # fallback: if not found, take last generated gen (if exists) and minimally adjust one stay to be in death city and span death
+    # fallback: if no attempt spans the death time, regenerate the itinerary around it
     if not victim_itin:
-        if 'gen' in locals() and gen:
-            # try to modify an existing stay so it is in the death city and spans the death time
-            idx = random.randrange(len(gen))
-            city_old, a_old, d_old = gen[idx]
-            # pick a stay window that will include death time
-            new_arr = min(a_old, VICTIM_DEATH_UTC - timedelta(hours=random.uniform(2, 12)))
-            new_dep = max(d_old, VICTIM_DEATH_UTC + timedelta(hours=random.uniform(2, 12)))
-            # set the city to the chosen death city to guarantee presence there at death time
-            gen[idx] = (death_city_label, max(START, new_arr), min(END, new_dep))
-            victim_itin = gen
-            print(f"Victim itinerary adjusted after {attempts} attempts (fallback -> forced into {death_city_label}).")
-        else:
-            # extreme fallback: create a small itinerary in the death city spanning death time
-            pre = VICTIM_DEATH_UTC - timedelta(hours=random.uniform(6, 48))
-            post = VICTIM_DEATH_UTC + timedelta(hours=random.uniform(6, 48))
-            victim_itin = [(death_city_label, max(START, pre), min(END, post))]
-            print(f"No generated itineraries available; created a fallback victim itinerary in {death_city_label}.")
-
+        victim_itin = solve_agent_itinerary([(death_city, VICTIM_DEATH_UTC)], rng=rng)
+        print(f"Victim itinerary solved after {attempts} attempts (fallback -> pinned in {death_city_label}).")
 
     # Ensure victim_itin has no consecutive same-city entries (generator already avoids that but we guard anyway)
     victim_itin_sorted = sorted(victim_itin, key=lambda t: t[1])
@@ -373,56 +1049,581 @@ def main():
             alt_city = city
             attempts = 0
             while alt_city == city and attempts < 10:
-                alt_city = city_label(random.choice(CITY_NAMES))
+                alt_city = CITY_INDEX[rng.choice(CITY_NAMES)]
                 attempts += 1
             city = alt_city
         patched.append((city, a, d))
     victim_itin = patched
 
     # Append the victim's itinerary AFTER other agents' entries (to keep earlier randomness identical)
+    presence.replace_agent(VICTIM_SSN, agent_itins.get(VICTIM_SSN, []), victim_itin)
     agent_itins[VICTIM_SSN] = victim_itin
 
-    # Rebuild rows_dt from agent_itins (keeping original order of agents roughly the same,
-    # but victim will be present as one of the keys — ensure victim's entries are placed after others)
-    rows_dt = []
-    # preserve original ssns order, but append victim last
-    ssns_ordered = [s for s in ssns if s != VICTIM_SSN]
-    for ssn in ssns_ordered:
-        entries = agent_itins.get(ssn, [])
-        for city, a, d in entries:
-            rows_dt.append((ssn, city, a, d))
-    # append victim last
-    for city, a, d in agent_itins[VICTIM_SSN]:
-        rows_dt.append((VICTIM_SSN, city, a, d))
-
-    # Now compute a jittered sort key for each row and sort by it to get "somewhat-sorted, somewhat-random" ordering.
-    rows_with_sortkey = []
-    for agent_ssn, city, arr_dt, dep_dt in rows_dt:
-        # jitter in hours; gaussian around 0, sd = SORT_JITTER_HOURS_SD
-        jitter_hours = random.gauss(0, SORT_JITTER_HOURS_SD)
-        sort_key = arr_dt + timedelta(hours=jitter_hours)
-        # clamp sort_key to the overall window to avoid pathological extremes
-        if sort_key < START:
-            sort_key = START + (sort_key - START) * 0  # set to START
-        if sort_key > END:
-            sort_key = END
-        rows_with_sortkey.append((sort_key, agent_ssn, city, arr_dt, dep_dt))
-
-    # sort by the jittered key
-    rows_with_sortkey.sort(key=lambda t: t[0])
-
-    # Convert to insertion-ready ISO strings
-    insert_rows = []
-    for _, agent_ssn, city, arr_dt, dep_dt in rows_with_sortkey:
-        insert_rows.append((agent_ssn, city, iso_utc(arr_dt), iso_utc(dep_dt)))
-
-    # Create SQLite DB and insert
-    if os.path.exists(OUT_DB):
-        print(f"Overwriting existing {OUT_DB}")
-        os.remove(OUT_DB)
-
-    conn = sqlite3.connect(OUT_DB)
-    cur = conn.cursor()
+# --- Scenario constraints (--placement solver) ---
+# A scenario is a list of JSON constraints; "$death_city" stands for the drawn death city.
+#   {"kind": "stay", "agent": SSN, "city": CITY, "at": ISO_TIME}
+#       the agent is in CITY at that time
+#   {"kind": "presence", "city": CITY, "at": ISO_TIME, "min": N, "max": M, "exclude": [SSN, ...]}
+#       between N and M agents, not counting `exclude`, are in CITY at that time
+# CITY is a catalog name ("Cairo") or label ("Cairo, Egypt").
+DEATH_CITY_PLACEHOLDER = "$death_city"
+# shortest layover the solver leaves between a filler stay and a pinned one
+MIN_LAYOVER_HOURS = 2.0
+# upper bound of travel_hours_between's jitter, used to keep pinned stays reachable
+MAX_TRAVEL_JITTER_HOURS = 1.5
+
+def default_scenario():
+    # the legacy victim placement, as constraints
+    at = iso_utc(VICTIM_DEATH_UTC)
+    return [
+        {"kind": "stay", "agent": VICTIM_SSN, "city": DEATH_CITY_PLACEHOLDER, "at": at},
+        {"kind": "presence", "city": DEATH_CITY_PLACEHOLDER, "at": at,
+         "min": MIN_OTHER_PRESENT, "max": MAX_OTHER_PRESENT, "exclude": [VICTIM_SSN]},
+    ]
+
+def with_scene_size(constraints, size):
+    # constraints with exactly size agents (besides the victim) at the scene of the death
+    at = iso_utc(VICTIM_DEATH_UTC)
+    scene = {"kind": "presence", "city": DEATH_CITY_PLACEHOLDER, "at": at, "min": size, "max": size,
+             "exclude": [VICTIM_SSN]}
+    rest = [c for c in constraints
+            if not (c.get("kind") == "presence" and c.get("city") == DEATH_CITY_PLACEHOLDER and c.get("at") == at)]
+    return rest + [scene]
+
+def load_scenario(path):
+    with open(path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    constraints = spec.get("constraints") if isinstance(spec, dict) else spec
+    if not isinstance(constraints, list) or not all(isinstance(c, dict) for c in constraints):
+        raise ValueError("scenario must be a JSON array of constraint objects or {\"constraints\": [...]}")
+    return constraints
+
+def resolve_scenario(constraints, death_city_name):
+    # validate constraints and turn cities into ids and times into aware datetimes
+    resolved = []
+    for n, c in enumerate(constraints):
+        city = death_city_name if c.get("city") == DEATH_CITY_PLACEHOLDER else c.get("city")
+        city_id = CITY_INDEX.get(city, CITY_LABEL_INDEX.get(city))
+        if city_id is None:
+            raise ValueError(f"constraint {n}: unknown city {city!r}")
+        at = datetime.fromisoformat(str(c.get("at", "")).replace("Z", "+00:00"))
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)
+        if not START <= at < END:
+            raise ValueError(f"constraint {n}: time {c['at']} is outside the generated window")
+        kind = c.get("kind")
+        if kind == "stay":
+            if not isinstance(c.get("agent"), str):
+                raise ValueError(f"constraint {n}: stay constraints need an agent SSN")
+            resolved.append({"kind": kind, "agent": c["agent"], "city": city_id, "at": at})
+        elif kind == "presence":
+            lo = int(c.get("min", 0))
+            hi = int(c.get("max", lo))
+            if not 0 <= lo <= hi:
+                raise ValueError(f"constraint {n}: need 0 <= min <= max")
+            resolved.append({"kind": kind, "city": city_id, "at": at, "min": lo, "max": hi,
+                             "exclude": set(c.get("exclude", []))})
+        else:
+            raise ValueError(f"constraint {n}: unknown kind {kind!r}")
+    return resolved
+
+def _stay_hours(rng):
+    # one stay length from the generator's distribution
+    return rng.choices(STAY_DAY_CHOICES, weights=STAY_DAY_WEIGHTS, k=1)[0] * 24 + rng.uniform(0, 20)
+
+def _snap_arrival(t, rng):
+    # the generator's arrival-minute snapping, never moving t later
+    snapped = t.replace(minute=rng.choice(QUARTER_HOUR_MINUTES), second=0, microsecond=0)
+    return snapped - timedelta(hours=1) if snapped > t else snapped
+
+def _hop(city_id, rng):
+    pool = HOP_NEIGHBOURS[city_id] if HOP_NEIGHBOURS is not None else CITY_IDS
+    return rng.choice(pool)
+
+def _avoids(city_id, arr, dep, avoid):
+    return not any(c == city_id and arr <= t < dep for c, t in avoid)
+
+def solve_agent_itinerary(pins, avoid=(), rng=random, max_attempts=20):
+    """
+    Build an itinerary that satisfies `pins` ([(city_id, t)]: in that city at t) and
+    `avoid` ([(city_id, t)]: not in that city at t) in one pass, without retries.
+
+    Each pinned stay is sampled conditionally on spanning its time (length from the
+    generator's stay distribution, t uniformly placed inside it, consecutive pins in one
+    city share a stay). The gaps before, between and after the pins are filled outwards
+    with the generator's hop, travel, layover and stay rules; a filler that would break a
+    pin or an avoid is re-drawn up to max_attempts times and otherwise left out, so only
+    the pins themselves are mandatory. Raises ValueError if two pinned cities are too
+    close in time to travel between. Returns StayStore entries (city ID, epoch us).
+    """
+    groups = []  # [city_id, first t, last t]
+    for city_id, t in sorted(pins, key=itemgetter(1)):
+        if groups and groups[-1][0] == city_id:
+            groups[-1][2] = t
+        else:
+            groups.append([city_id, t, t])
+
+    def reach_hours(a, b):
+        # worst-case door-to-door time between two pinned cities
+        return TRAVEL.hours(a, b) + MAX_TRAVEL_JITTER_HOURS + MIN_LAYOVER_HOURS
+
+    pinned = []
+    for i, (city_id, first, last) in enumerate(groups):
+        arr_min, dep_max = START, END
+        if pinned:
+            arr_min = pinned[-1][2] + timedelta(hours=reach_hours(pinned[-1][0], city_id))
+        if i + 1 < len(groups):
+            dep_max = groups[i + 1][1] - timedelta(hours=reach_hours(city_id, groups[i + 1][0]))
+        for c, t in avoid:
+            if c == city_id and t < first:
+                arr_min = max(arr_min, t + timedelta(seconds=1))
+            elif c == city_id and t > last:
+                dep_max = min(dep_max, t)
+            elif c == city_id:
+                raise ValueError(f"pinned and avoided in {CITY_LABELS[c]} at {iso_utc(t)}")
+        if arr_min > first or dep_max <= last:
+            raise ValueError(f"cannot reach {CITY_LABELS[city_id]} by {iso_utc(first)}")
+        span_h = (last - first).total_seconds() / 3600
+        stay_h = max(_stay_hours(rng), span_h + 1)
+        arr = max(arr_min, _snap_arrival(first - timedelta(hours=rng.uniform(0, stay_h - span_h)), rng))
+        dep = min(max(arr + timedelta(hours=stay_h), last + timedelta(hours=1)), dep_max)
+        pinned.append((city_id, arr, dep))
+
+    if not pinned:
+        # nothing pinned: open inside the generator's start window instead
+        for _ in range(max_attempts):
+            city_id = rng.choice(CITY_IDS)
+            arr = START + timedelta(days=rng.uniform(0, 10), hours=rng.uniform(0, 23),
+                                    minutes=rng.choice(QUARTER_HOUR_MINUTES))
+            dep = min(END, arr + timedelta(hours=_stay_hours(rng)))
+            if _avoids(city_id, arr, dep, avoid):
+                break
+        else:
+            raise ValueError("no opening stay clears the avoided cities")
+        pinned.append((city_id, arr, dep))
+
+    trips_left = MAX_TRIPS_PER_AGENT - len(pinned)
+
+    def forward(city_id, t, until_city=None, until=END):
+        # filler stays after (city_id, departure t), ending in time to reach until_city by until
+        nonlocal trips_left
+        stays = []
+        while trips_left > 0:
+            for _ in range(max_attempts):
+                nxt = _hop(city_id, rng)
+                if nxt == city_id or nxt == until_city:
+                    continue
+                arr = t + timedelta(hours=travel_hours_between(city_id, nxt, rng) + rng.uniform(2, 36))
+                if arr > until:
+                    return stays
+                arr = _snap_arrival(arr, rng)
+                dep = arr + timedelta(hours=_stay_hours(rng))
+                if until_city is not None:
+                    if dep + timedelta(hours=reach_hours(nxt, until_city)) > until:
+                        return stays
+                elif dep > END:
+                    if arr + timedelta(hours=4) >= END:
+                        return stays
+                    dep = max(arr + timedelta(hours=1), END - timedelta(hours=rng.uniform(0, 6)))
+                if _avoids(nxt, arr, dep, avoid):
+                    break
+            else:
+                return stays
+            stays.append((nxt, arr, dep))
+            trips_left -= 1
+            city_id, t = nxt, dep
+        return stays
+
+    def backward(city_id, t):
+        # filler stays before (city_id, arrival t), starting no earlier than START
+        nonlocal trips_left
+        stays = []
+        first = False
+        while trips_left > 0 and not first:
+            for _ in range(max_attempts):
+                prev = _hop(city_id, rng)
+                if prev == city_id:
+                    continue
+                dep = t - timedelta(hours=travel_hours_between(prev, city_id, rng) + rng.uniform(2, 36))
+                if dep < START + timedelta(hours=4):
+                    return stays[::-1]
+                arr = _snap_arrival(dep - timedelta(hours=_stay_hours(rng)), rng)
+                first = arr < START
+                if first:
+                    # the generator's first arrivals fall inside the window, not on its edge
+                    hours = (dep - START).total_seconds() / 3600
+                    arr = max(START, _snap_arrival(START + timedelta(hours=rng.uniform(0, hours - 4)), rng))
+                if _avoids(prev, arr, dep, avoid):
+                    break
+            else:
+                break
+            stays.append((prev, arr, dep))
+            trips_left -= 1
+            city_id, t = prev, arr
+        return stays[::-1]
+
+    itinerary = []
+    gaps = [forward(a[0], a[2], b[0], b[1]) for a, b in zip(pinned, pinned[1:])]
+    itinerary.extend(backward(pinned[0][0], pinned[0][1]))
+    for stay, gap in zip(pinned, gaps + [None]):
+        itinerary.append(stay)
+        itinerary.extend(gap if gap is not None else forward(stay[0], stay[2]))
+    return [(c, to_us(arr), to_us(dep)) for c, arr, dep in itinerary]
+
+def solve_scenario(agent_itins, presence, constraints, rng=random):
+    """
+    Satisfy resolved scenario constraints in a single pass. Stay constraints pin agents
+    (adding agents that have no itinerary yet); each presence constraint then pins or
+    un-pins just enough agents. Every touched agent's whole itinerary is rebuilt with
+    solve_agent_itinerary, keeping its standing for the presence constraints settled
+    before, so later constraints never undo earlier ones. Raises ValueError when a
+    presence constraint cannot be met from the available agents.
+    """
+    pins = {}   # ssn -> [(city_id, t)]
+    avoid = {}  # ssn -> [(city_id, t)]
+    settled = []
+
+    def rebuild(ssn):
+        for c in settled:
+            key = (c["city"], c["at"])
+            if key not in pins.get(ssn, ()) and key not in avoid.get(ssn, ()):
+                here = presence.is_present(ssn, c["city"], to_us(c["at"]))
+                (pins if here else avoid).setdefault(ssn, []).append(key)
+        entries = solve_agent_itinerary(pins.get(ssn, []), avoid.get(ssn, []), rng)
+        presence.replace_agent(ssn, agent_itins.get(ssn, []), entries)
+        agent_itins[ssn] = entries
+
+    for c in constraints:
+        if c["kind"] == "stay":
+            pins.setdefault(c["agent"], []).append((c["city"], c["at"]))
+    for ssn in pins:
+        rebuild(ssn)
+    print(f"Scenario: pinned {len(pins)} agent(s).")
+
+    for c in constraints:
+        if c["kind"] != "presence":
+            continue
+        label = CITY_LABELS[c["city"]]
+        key = (c["city"], c["at"])
+        present = presence.agents_present(c["city"], to_us(c["at"])) - c["exclude"]
+        count = len(present)
+        if count < c["min"]:
+            step, target = 1, pins
+            candidates = [s for s in agent_itins if s not in present and s not in c["exclude"]]
+        else:
+            step, target = -1, avoid
+            candidates = [s for s in agent_itins if s in present and key not in pins.get(s, ())]
+        need = c["min"] - count if count < c["min"] else count - c["max"]
+        if need > 0:
+            # a random order, agents without pins first; a candidate whose pins cannot take
+            # the new requirement is skipped
+            rng.shuffle(candidates)
+            candidates.sort(key=lambda s: s in pins)
+            for ssn in candidates:
+                if need == 0:
+                    break
+                target.setdefault(ssn, []).append(key)
+                try:
+                    rebuild(ssn)
+                except ValueError:
+                    target[ssn].remove(key)
+                    continue
+                count += step
+                need -= 1
+        if not c["min"] <= count <= c["max"]:
+            raise ValueError(f"cannot get {c['min']}-{c['max']} agents into {label} at {iso_utc(c['at'])}")
+        settled.append(c)
+        print(f"Scenario: {count} agent(s) present at {label} at {iso_utc(c['at'])} "
+              f"(target between {c['min']} and {c['max']}).")
+
+def iter_agent_rows(agent_itins, ssn_order):
+    for ssn in ssn_order:
+        for city, a, d in agent_itins.get(ssn, []):
+            yield ssn, city, a, d
+
+def jittered_row_order(agent_itins, ssn_order, rng=random):
+    # Compute a jittered sort key for each row and sort by it to get "somewhat-sorted, somewhat-random" ordering.
+    # Rows are held in parallel typed arrays (see StayStore), agents by their index in ssn_order,
+    # and only an index is sorted.
+    agents, keys, cities, arrivals, departures = array("I"), array("q"), array("I"), array("q"), array("q")
+    for agent, ssn in enumerate(ssn_order):
+        for city, arr, dep in agent_itins.get(ssn, []):
+            # jitter in hours; gaussian around 0, sd = SORT_JITTER_HOURS_SD
+            jitter_hours = rng.gauss(0, SORT_JITTER_HOURS_SD)
+            sort_key = arr + hours_us(jitter_hours)
+            # clamp sort_key to the overall window to avoid pathological extremes
+            if sort_key < START_US:
+                sort_key = START_US
+            if sort_key > END_US:
+                sort_key = END_US
+            keys.append(sort_key)
+            agents.append(agent)
+            cities.append(city)
+            arrivals.append(arr)
+            departures.append(dep)
+
+    order = stable_argsort(keys)
+    return ((keys[i], ssn_order[agents[i]], cities[i], arrivals[i], departures[i]) for i in order)
+
+def stable_argsort(keys):
+    # row indexes of an array("q") in key order, ties in row order
+    if np is not None:
+        return np.argsort(np.frombuffer(keys, dtype=np.int64), kind="stable")
+    # sorted() is stable too; only the index survives the sort
+    return array("I", sorted(range(len(keys)), key=keys.__getitem__))
+
+def _clamp_to_window(t):
+    return min(max(t, START_US), END_US)
+
+def take(values, order):
+    # typed array values reordered by the row indexes in order
+    if np is not None:
+        return array(values.typecode, np.frombuffer(values, dtype=values.typecode)[order].tobytes())
+    return array(values.typecode, [values[i] for i in order])
+
+def _write_spill_run(columns):
+    # columns: sorted parallel typed arrays
+    run = tempfile.TemporaryFile()
+    for i in range(0, len(columns[0]), SPILL_BLOCK_ROWS):
+        pickle.dump([c[i:i + SPILL_BLOCK_ROWS] for c in columns], run, protocol=pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+def _read_spill_run(run):
+    with run:
+        while True:
+            try:
+                block = pickle.load(run)
+            except EOFError:
+                return
+            yield from zip(*block)
+
+def streaming_jittered_order(agent_itins, ssn_order, max_window_bytes=ORDER_WINDOW_MAX_BYTES, rng=random):
+    """
+    Same "somewhat sorted" interleaving as jittered_row_order, without holding the dataset.
+
+    Each agent's stays (a StayStore) are sorted by arrival; the agents are k-way merged by
+    arrival through a heap of one int per agent, reading the stays in place, and each row
+    gets its jittered key and waits in a window of typed arrays (key, agent index in
+    ssn_order, row offset). Jitter is truncated at SORT_JITTER_WINDOW_SDS, so once the merge
+    reaches arrival A no later row can get a key below A - bound: whenever the window has
+    doubled since its last sort, it is stable-sorted and every row keyed at or below that
+    is final and is yielded. If the rows left would fill half of max_window_bytes, they are
+    spilled as a sorted run to a temp file and the rest of the stream is finished as an
+    external merge over the runs.
+    Yields (sort_key, ssn, city, arrival, departure) like jittered_row_order, in the order of
+    the (sort_key, merge position) pairs.
+    """
+    bound_h = SORT_JITTER_HOURS_SD * SORT_JITTER_WINDOW_SDS
+    bound = hours_us(bound_h)
+    n = max(len(ssn_order), 1)
+    store = (agent_itins.city, agent_itins.arrival, agent_itins.departure)
+    side = {}  # agent -> columns of an agent whose stays placement replaced
+    cursor, stop = array("q"), array("q")
+    heap = []  # arrival * n + agent: ties go to the earlier agent, as in heapq.merge
+    for agent, ssn in enumerate(ssn_order):
+        cities, arrivals, departures, start, end = agent_itins.columns(ssn) if ssn in agent_itins \
+            else (None, None, None, 0, 0)
+        if cities is not store[0]:
+            side[agent] = (cities, arrivals, departures)
+        cursor.append(start)
+        stop.append(end)
+        if start < end:
+            heap.append(arrivals[start] * n + agent)
+    heapq.heapify(heap)
+
+    def window_arrays():
+        return array("q"), array("I"), array("q")
+
+    def rows(columns, upto):
+        for key, agent, i in zip(*(c[:upto] for c in columns)):
+            cities, arrivals, departures = side.get(agent, store)
+            yield key, ssn_order[agent], cities[i], arrivals[i], departures[i]
+
+    max_rows = max(1, max_window_bytes // sum(c.itemsize for c in window_arrays()))
+    keys, agents, offsets = window_arrays()
+    kept = 0  # rows at the head of the window that are already sorted
+    runs = []
+    while heap:
+        arr, agent = divmod(heap[0], n)
+        i = cursor[agent]
+        cursor[agent] = i + 1
+        if i + 1 < stop[agent]:
+            arrivals = side[agent][1] if agent in side else store[1]
+            heapq.heapreplace(heap, arrivals[i + 1] * n + agent)
+        else:
+            heapq.heappop(heap)
+        jitter_hours = rng.gauss(0, SORT_JITTER_HOURS_SD)
+        while abs(jitter_hours) > bound_h:
+            jitter_hours = rng.gauss(0, SORT_JITTER_HOURS_SD)
+        keys.append(_clamp_to_window(arr + hours_us(jitter_hours)))
+        agents.append(agent)
+        offsets.append(i)
+        if len(keys) < (max_rows if runs else min(max_rows, max(2 * kept, ORDER_WINDOW_MIN_SORT_ROWS))):
+            continue
+        # a stable sort keeps equal keys in merge order
+        order = stable_argsort(keys)
+        columns = [take(c, order) for c in (keys, agents, offsets)]
+        done = 0 if runs else bisect.bisect_right(columns[0], _clamp_to_window(arr - bound))
+        yield from rows(columns, done)
+        kept = len(keys) - done
+        if kept > max_rows // 2 or runs:
+            runs.append(_write_spill_run([c[done:] for c in columns]))
+            keys, agents, offsets = window_arrays()
+            kept = 0
+        else:
+            keys, agents, offsets = (c[done:] for c in columns)
+
+    columns = [take(c, stable_argsort(keys)) for c in (keys, agents, offsets)] if keys else window_arrays()
+    if runs:
+        print(f"Jitter window spilled {len(runs)} sorted run(s) to disk.")
+        # runs hold earlier merge positions than later runs and the window, so the merge's
+        # ties going to the earlier input keep equal keys in order
+        tail = heapq.merge(*[_read_spill_run(run) for run in runs], zip(*columns), key=itemgetter(0))
+        for key, agent, i in tail:
+            cities, arrivals, departures = side.get(agent, store)
+            yield key, ssn_order[agent], cities[i], arrivals[i], departures[i]
+    else:
+        yield from rows(columns, len(columns[0]))
+
+def iter_fly_insert_rows(ordered_rows):
+    # Convert to insertion-ready labels and ISO strings lazily, one row at a time
+    for _, agent_ssn, city, arr, dep in ordered_rows:
+        yield (agent_ssn, CITY_LABELS[city], iso_utc_seconds(arr // 1_000_000), iso_utc_seconds(dep // 1_000_000))
+
+def insert_chunked(cur, sql, rows, chunk_size=INSERT_CHUNK_ROWS):
+    rows = iter(rows)
+    inserted = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return inserted
+        cur.executemany(sql, chunk)
+        inserted += len(chunk)
+
+def open_build_db(path):
+    # Bulk-load settings: no rollback journal and no fsyncs while the file is being built.
+    # Neither pragma persists in the file, so readers of the finished DB get SQLite defaults.
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = OFF;")
+    conn.execute("PRAGMA synchronous = OFF;")
+    conn.execute("BEGIN;")
+    return conn
+
+class PipelineResult:
+    """Rows of a statement queued to a WriterPipeline; fetching waits until it has run."""
+
+    def __init__(self, pipeline):
+        self._pipeline = pipeline
+        self._done = threading.Event()
+        self._rows = None
+
+    def fetchall(self):
+        while not self._done.wait(0.1):
+            self._pipeline.check()
+        self._pipeline.check()
+        return self._rows
+
+    def fetchone(self):
+        rows = self.fetchall()
+        return rows[0] if rows else None
+
+class WriterPipeline:
+    """
+    Cursor stand-in for --pipeline builds: a writer thread owns the build connection
+    (open_build_db, one bulk transaction) and runs the statements and row batches handed
+    to execute/executemany in order, while the calling thread goes on ordering, formatting
+    and generating rows. The queue holds at most max_batches batches, so a producer that
+    outruns SQLite blocks instead of buffering the table in memory. Statements are passed
+    to count (like a trace callback, once per executemany row) as they are queued, so they
+    are attributed to the phase that issued them. Statement results come back as
+    PipelineResult; an error in the writer is re-raised in the producer.
+
+    After close(), writer_cpu_s is the writer thread's CPU time and waited_s the time the
+    producer spent blocked on a full queue.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path, count=None, max_batches=PIPELINE_QUEUE_BATCHES):
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._count = count
+        self._error = None
+        self._ready = threading.Event()
+        self.writer_cpu_s = 0.0
+        self.waited_s = 0.0
+        self._thread = threading.Thread(target=self._run, args=(path,), name="sqlite-writer", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        self.check()
+
+    def _run(self, path):
+        conn = None
+        try:
+            conn = open_build_db(path)
+            cur = conn.cursor()
+            self._ready.set()
+            while True:
+                item = self._queue.get()
+                if item is self._STOP:
+                    break
+                many, sql, params, result = item
+                if many:
+                    cur.executemany(sql, params)
+                else:
+                    rows = cur.execute(sql, params).fetchall()
+                    result._rows = rows
+                    result._done.set()
+        except BaseException as e:
+            # the producer polls for this while it waits on the queue or a result
+            self._error = e
+            self._ready.set()
+        finally:
+            if conn is not None:
+                conn.close()
+            self.writer_cpu_s = time.thread_time()
+
+    def _put(self, item):
+        self.check()
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        started = time.perf_counter()
+        while True:
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                self.check()
+        self.waited_s += time.perf_counter() - started
+
+    def check(self):
+        if self._error is not None:
+            raise self._error
+
+    def execute(self, sql, params=()):
+        if self._count is not None:
+            self._count(sql)
+        result = PipelineResult(self)
+        self._put((False, sql, params, result))
+        return result
+
+    def executemany(self, sql, rows):
+        # rows are materialized here, on the producing thread
+        rows = rows if isinstance(rows, list) else list(rows)
+        if self._count is not None:
+            self._count(sql, len(rows))
+        self._put((True, sql, rows, None))
+
+    def close(self):
+        """Wait for every queued statement to run, then close the connection."""
+        self._put(self._STOP)
+        self._thread.join()
+        self.check()
+
+def write_fly_table(cur, rows):
     cur.execute("""
         CREATE TABLE fly (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -432,50 +1633,172 @@ def main():
             departure_time TEXT NOT NULL
         );
     """)
-    cur.executemany("INSERT INTO fly (agent_ssn, city, arrival_time, departure_time) VALUES (?, ?, ?, ?);", insert_rows)
-    conn.commit()
+    return insert_chunked(cur, "INSERT INTO fly (agent_ssn, city, arrival_time, departure_time) VALUES (?, ?, ?, ?);", rows)
 
-    cur.execute("SELECT COUNT(*) FROM fly;")
-    count = cur.fetchone()[0]
-    print(f"Inserted {count} flight records into {OUT_DB}.")
+# --layout optimized: city dimension table, integer agent keys and integer-epoch timestamps.
+# fly_stay refers to agents by who.id, which build_database knows up front (who rows go in
+# in agent order). `fly` becomes a view with the original column names; arrival_time and
+# departure_time are rendered from the epochs in the same "2025-09-03T13:22:00Z" format, and
+# the epochs are exposed too: predicates on them seek in the (city, time) index, while
+# predicates on the ISO text only narrow the seek to the city and filter the rest.
+OPTIMIZED_FLY_SCHEMA = [
+    """
+    CREATE TABLE city (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        country TEXT NOT NULL,
+        label TEXT NOT NULL UNIQUE
+    );
+    """,
+    """
+    CREATE TABLE fly_stay (
+        id INTEGER PRIMARY KEY,
+        agent_id INTEGER NOT NULL REFERENCES who(id),
+        city_id INTEGER NOT NULL REFERENCES city(id),
+        arrival_epoch INTEGER NOT NULL,
+        departure_epoch INTEGER NOT NULL
+    );
+    """,
+    # who is created later in the same transaction; SQLite resolves view tables on use.
+    # ORDER BY s.id lists rows in fly.id order like the compat table; filtered queries
+    # still seek fly_stay's indexes and only sort the rows they match
+    """
+    CREATE VIEW fly AS
+    SELECT s.id, w.ssn AS agent_ssn, c.label AS city,
+           strftime('%Y-%m-%dT%H:%M:%SZ', s.arrival_epoch, 'unixepoch') AS arrival_time,
+           strftime('%Y-%m-%dT%H:%M:%SZ', s.departure_epoch, 'unixepoch') AS departure_time,
+           s.arrival_epoch, s.departure_epoch
+    FROM fly_stay s JOIN city c ON c.id = s.city_id JOIN who w ON w.id = s.agent_id
+    ORDER BY s.id;
+    """,
+]
+# created after the bulk load, one per puzzle question: "who was in city X at time T"
+# (seeks on city and arrival; departure is checked on the few rows left) and "where was
+# agent X" (who.ssn's unique index gives the ID)
+OPTIMIZED_FLY_INDEXES = [
+    "CREATE INDEX fly_stay_city_time ON fly_stay (city_id, arrival_epoch);",
+    "CREATE INDEX fly_stay_agent ON fly_stay (agent_id);",
+]
+# smallest file of the sizes tried (512-8192 bytes) and sql.js's own default
+OPTIMIZED_PAGE_SIZE = 4096
 
-    # --- Generate WHO table ---
-    FIRST_NAMES = ["Alex", "Jamie", "Taylor", "Jordan", "Casey", "Morgan", "Avery", "Riley", "Parker", "Quinn",
-                   "Sam", "Charlie", "Cameron", "Drew", "Rowan", "Reese", "Hayden", "Kai", "Sasha", "Elliot",
-                   "Noah", "Liam", "Mason", "Ethan", "Logan", "Lucas", "Oliver", "Aiden", "Carter", "Grayson",
-                   "Hannah", "Olivia", "Emma", "Ava", "Isabella", "Sophia", "Mia", "Charlotte", "Amelia", "Harper",
-                   "Benjamin", "William", "James", "Henry", "Jacob", "Michael", "Daniel", "Matthew", "Joseph", "David",
-                   "Zoe", "Chloe", "Lily", "Madison", "Emily", "Aria", "Scarlett", "Victoria", "Grace", "Nora",
-                   "Ian", "Victor", "Gabe", "Marcus", "Leo", "Felix", "Simon", "Owen", "Evan", "Adam",
-                   "Brandon", "Natalie", "Ruby", "Josie", "Maya", "Ivy", "Alice", "Elsa", "Irene", "June"]
-    LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Miller", "Davis", "Garcia", "Rodriguez", "Wilson",
-                  "Martinez", "Anderson", "Taylor", "Thomas", "Hernandez", "Moore", "Martin", "Jackson", "Thompson", "White",
-                  "Lopez", "Lee", "Gonzalez", "Harris", "Clark", "Lewis", "Robinson", "Ingraham", "Walker", "Perez", "Hall",
-                  "Young", "Allen", "Sanchez", "Wright", "King", "Scott", "Green", "Baker", "Adams", "Nelson", "Irving",
-                  "Hill", "Ramirez", "Campbell", "Mitchell", "Roberts", "Carter", "Phillips", "Evans", "Turner", "Torres",
-                  "Parker", "Collins", "Edwards", "Stewart", "Flores", "Morris", "Nguyen", "Murphy", "Rivera", "Cook",
-                  "Rogers", "Morgan", "Peterson", "Cooper", "Reed", "Bailey", "Bell", "Gomez", "Kelly", "Howard",
-                  "Ward", "Cox", "Diaz", "Richardson", "Wood", "Watson", "Brooks", "Bennett", "Gray", "James",
-                  "Reyes", "Cruz", "Hughes", "Price", "Myers", "Long", "Foster", "Sanders", "Ross", "Morales"]
-    EYE_COLORS = ["brown", "blue", "green", "hazel", "gray", "amber"]
-
-    def generate_unique_names(n):
-        all_pairs = [(f, l) for f in FIRST_NAMES for l in LAST_NAMES]
-        return [f"{f} {l}" for f, l in random.sample(all_pairs, n)]
-
-    def generate_who_records(ssns):
-        n = len(ssns)
-        names = generate_unique_names(n)
-        records = []
-        for ssn, name in zip(ssns, names):
-            height = int(max(150, min(200, round(random.gauss(175, 10)))))
-            weight = int(max(50, min(130, round(random.gauss(75, 12)))))
-            eye = random.choice(EYE_COLORS)
-            records.append((VICTIM_NAME if ssn == VICTIM_SSN else name, ssn, height, eye, weight))
-        return records
-
-    # Generate and insert WHO table
-    who_records = generate_who_records([s for s in agent_itins.keys()])
+def agent_ids(ssns):
+    # who.id per SSN for agents written in this order (who.id counts from 1)
+    return {ssn: i for i, ssn in enumerate(ssns, 1)}
+
+def write_optimized_fly_tables(cur, ordered_rows, ids):
+    for statement in OPTIMIZED_FLY_SCHEMA:
+        cur.execute(statement)
+    cur.executemany("INSERT INTO city (id, name, country, label) VALUES (?, ?, ?, ?);",
+                    [(i, name, CITIES[name][2], CITY_LABELS[i]) for i, name in enumerate(CITY_NAMES)])
+    # floor division truncates to whole seconds, like iso_utc does
+    rows = ((ids[ssn], city, arr // 1_000_000, dep // 1_000_000) for _, ssn, city, arr, dep in ordered_rows)
+    return insert_chunked(cur, "INSERT INTO fly_stay (agent_id, city_id, arrival_epoch, departure_epoch) "
+                               "VALUES (?, ?, ?, ?);", rows)
+
+def finalize_optimized_db(path, page_size, trace=None):
+    # runs after COMMIT: rewrite at the tuned page size, packed, with planner statistics
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.set_trace_callback(trace)
+    conn.execute(f"PRAGMA page_size = {int(page_size)};")
+    conn.execute("ANALYZE;")
+    conn.execute("VACUUM;")
+    conn.close()
+
+class FeistelPermutation:
+    """
+    Keyed bijection on range(size): a balanced Feistel network over the smallest even
+    number of bits covering size, cycle-walked back into range. Any position is computed
+    on its own in O(1) memory, so the first n outputs are a uniform sample without
+    replacement that never materializes the domain.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, size, rng=random):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        self._half = (bits + 1) // 2
+        self._mask = (1 << self._half) - 1
+        self._keys = [rng.getrandbits(64) for _ in range(self.ROUNDS)]
+
+    def _round(self, x, key):
+        x = ((x ^ key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        return (x ^ (x >> 31)) & self._mask
+
+    def __call__(self, i):
+        # the padded domain is under 4x size, so cycle walking takes few steps
+        while True:
+            left, right = i >> self._half, i & self._mask
+            for key in self._keys:
+                left, right = right, left ^ self._round(right, key)
+            i = (left << self._half) | right
+            if i < self.size:
+                return i
+
+def compose_name(index, middle_options, suffix_options):
+    # mixed-radix decode of a name index: (first, middle, last, suffix)
+    index, suffix = divmod(index, suffix_options)
+    index, last = divmod(index, len(LAST_NAMES))
+    first, middle = divmod(index, middle_options)
+    parts = [FIRST_NAMES[first]]
+    if middle:
+        middle -= 1
+        if middle >= len(MIDDLE_INITIALS):
+            middle -= len(MIDDLE_INITIALS)
+            parts.append(f"{MIDDLE_INITIALS[middle // len(MIDDLE_INITIALS)]}.")
+        parts.append(f"{MIDDLE_INITIALS[middle % len(MIDDLE_INITIALS)]}.")
+    parts.append(LAST_NAMES[last])
+    if suffix:
+        parts.append(NAME_SUFFIXES[suffix - 1])
+    return " ".join(parts)
+
+def iter_unique_names(n, rng=random):
+    """
+    n distinct names, deterministic for the rng state. Up to FIRST_NAMES x LAST_NAMES this
+    is rng.sample over the pair indices (the same draws, and names, as sampling the pair
+    list itself); beyond that, the first n positions of a keyed permutation of the
+    smallest NAME_TIERS space that fits.
+    """
+    base = len(FIRST_NAMES) * len(LAST_NAMES)
+    if n <= base:
+        for index in rng.sample(range(base), n):
+            yield compose_name(index, 1, 1)
+        return
+    for middle_options, suffix_options in NAME_TIERS:
+        size = base * middle_options * suffix_options
+        if n <= size:
+            break
+    else:
+        raise ValueError(f"{n} unique names requested; the name space holds {size}")
+    permutation = FeistelPermutation(size, rng)
+    for i in range(n):
+        yield compose_name(permutation(i), middle_options, suffix_options)
+
+def generate_unique_names(n, rng=random):
+    return list(iter_unique_names(n, rng))
+
+def generate_who_records(ssns, rng=random, attr_rng_for=None):
+    # names are drawn from rng; height/weight/eye from attr_rng_for(ssn) when given, else rng too
+    n = len(ssns)
+    names = generate_unique_names(n, rng)
+    records = []
+    for ssn, name in zip(ssns, names):
+        if attr_rng_for is not None:
+            rng = attr_rng_for(ssn)
+        height, eye, weight = who_attributes(rng)
+        records.append((VICTIM_NAME if ssn == VICTIM_SSN else name, ssn, height, eye, weight))
+    return records
+
+def who_attributes(rng=random):
+    # (height_cm, eye_color, weight_kg)
+    height = int(max(150, min(200, round(rng.gauss(175, 10)))))
+    weight = int(max(50, min(130, round(rng.gauss(75, 12)))))
+    eye = rng.choice(EYE_COLORS)
+    return height, eye, weight
+
+def write_who_table(cur, records):
+    # ids are explicit: row i of records is who.id i + 1, the id the overrides refer to
     cur.execute("""
                 CREATE TABLE who
                 (
@@ -487,98 +1810,1458 @@ def main():
                     weight_kg INTEGER
                 );
                 """)
-    cur.executemany("INSERT INTO who (name, ssn, height_cm, eye_color, weight_kg) VALUES (?, ?, ?, ?, ?);", who_records)
-    conn.commit()
-    cur.execute("SELECT COUNT(*) FROM who;")
-    count_who = cur.fetchone()[0]
-    print(f"Inserted {count_who} agent records into 'who' table.")
+    return insert_chunked(cur, "INSERT INTO who (id, name, ssn, height_cm, eye_color, weight_kg) VALUES (?, ?, ?, ?, ?, ?);",
+                          ((row_id, *record) for row_id, record in enumerate(records, 1)))
 
-    # --- Override specific who table names to spell via last-name initials ---
-    # IDs in order provided by user
-    target_ids = [287, 280, 40, 290, 225, 79, 254, 46, 211]
-    target_word = "SEIDPREBW"  # letters to match
-    if len(target_ids) != len(target_word):
-        print("Mismatch between length of target IDs and letters", file=sys.stderr)
-        sys.exit(1)
+def load_name_overrides(path):
+    # JSON object: {"<who.id>": "<letter>" | {"initial": "<letter>"} | {"name": "<full name>"}}
+    with open(path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    if not isinstance(spec, dict):
+        raise ValueError("name overrides must be a JSON object keyed by who.id")
+    overrides = {}
+    for row_id, constraint in spec.items():
+        if isinstance(constraint, str):
+            constraint = {"initial": constraint}
+        if not isinstance(constraint, dict) or len(constraint) != 1 or not {"initial", "name"} & constraint.keys():
+            raise ValueError(f"override for id {row_id}: expected a letter, {{\"initial\": ...}} or {{\"name\": ...}}")
+        overrides[int(row_id)] = constraint
+    return overrides
 
-    # Build index of existing names for uniqueness checking
-    cur.execute("SELECT id, name FROM who;")
-    existing_rows = cur.fetchall()
-    existing_names = {name for _, name in existing_rows}
-    existing_ids = {row_id for row_id, _ in existing_rows}
+def apply_name_overrides(records, overrides):
+    """
+    Apply {who.id: constraint} overrides, in order, to the in-memory who records (row i is
+    who.id i + 1) before they are inserted. An {"initial": letter} row keeps its first name
+    with the first last name starting with letter that keeps every name unique (else the
+    first free first name with such a last name); a {"name": full_name} row takes that
+    name. A name -> row hash index and a last-names-by-initial index replace the per-row
+    SQL lookups. Returns the number of rows changed.
+    """
+    by_name = {record[0]: i for i, record in enumerate(records)}
+    by_initial = {}
+    for ln in LAST_NAMES:
+        by_initial.setdefault(ln[:1], []).append(ln)
 
     # Pre-check: ensure we have at least one available last name for every needed initial
-    initials_ok = True
-    initial_to_candidates = {}
-    for ch in set(target_word):
-        cand = [ln for ln in LAST_NAMES if ln.startswith(ch)]
-        if not cand:
-            print(f"No available last names starting with required letter '{ch}'", file=sys.stderr)
-            initials_ok = False
-        initial_to_candidates[ch] = cand
-    if not initials_ok:
+    letters = sorted({c["initial"] for c in overrides.values() if "initial" in c})
+    missing = [ch for ch in letters if ch not in by_initial]
+    for ch in missing:
+        print(f"No available last names starting with required letter '{ch}'", file=sys.stderr)
+    if missing:
         print("Aborting overrides due to missing last name initials.", file=sys.stderr)
         sys.exit(1)
 
-    # Apply overrides sequentially
-    for row_id, letter in zip(target_ids, target_word):
-        if row_id not in existing_ids:
-            print(f"Row id {row_id} not found in who table; cannot apply SPIDERWEB override.", file=sys.stderr)
-            sys.exit(1)
-        # Fetch current name
-        cur.execute("SELECT name FROM who WHERE id = ?;", (row_id,))
-        res = cur.fetchone()
-        if not res:
-            print(f"Failed to fetch name for id {row_id}", file=sys.stderr)
+    changed = 0
+    for row_id, constraint in overrides.items():
+        if not 1 <= row_id <= len(records):
+            print(f"Row id {row_id} not found in who table; cannot apply override.", file=sys.stderr)
             sys.exit(1)
-        current_name = res[0]
-        parts = current_name.split()
-        if len(parts) < 2:
-            # If victim single token or malformed, fabricate a first name token
-            first_name = parts[0]
+        record = records[row_id - 1]
+        current_name = record[0]
+        if "name" in constraint:
+            new_full_name = constraint["name"]
+            reason = "name"
+            if new_full_name != current_name and new_full_name in by_name:
+                print(f"Name '{new_full_name}' for id {row_id} is already taken", file=sys.stderr)
+                sys.exit(1)
         else:
-            first_name = parts[0]
-        # Choose a last name starting with the needed letter; deterministic: first candidate that works
-        last_name_candidates = initial_to_candidates[letter]
-        chosen_last = None
-        for ln in last_name_candidates:
-            candidate_full = f"{first_name} {ln}"
-            # allow if we're not changing (same name) OR unique
-            if candidate_full == current_name or candidate_full not in existing_names:
-                chosen_last = ln
-                break
-        if chosen_last is None:
-            # Need to vary first name until unique with one of the last names
-            for ln in last_name_candidates:
-                for alt_first in FIRST_NAMES:
-                    candidate_full = f"{alt_first} {ln}"
-                    if candidate_full not in existing_names:
-                        first_name = alt_first
-                        chosen_last = ln
-                        break
-                if chosen_last:
-                    break
-        if chosen_last is None:
-            print(f"Unable to find unique name for id {row_id} with initial '{letter}'", file=sys.stderr)
-            sys.exit(1)
+            letter = constraint["initial"]
+            reason = f"initial {letter}"
+            first_name = current_name.split()[0]
+            # deterministic: first last name that keeps the name (or makes it unique)
+            new_full_name = next((f"{first_name} {ln}" for ln in by_initial[letter]
+                                  if f"{first_name} {ln}" == current_name or f"{first_name} {ln}" not in by_name),
+                                 None)
+            if new_full_name is None:
+                # Need to vary first name until unique with one of the last names
+                new_full_name = next((f"{alt_first} {ln}" for ln in by_initial[letter] for alt_first in FIRST_NAMES
+                                      if f"{alt_first} {ln}" not in by_name), None)
+            if new_full_name is None:
+                print(f"Unable to find unique name for id {row_id} with initial '{letter}'", file=sys.stderr)
+                sys.exit(1)
 
-        new_full_name = f"{first_name} {chosen_last}"
         if new_full_name == current_name:
             # Already matches criteria; nothing to change (still counts toward spelling)
-            print(f"ID {row_id} already satisfies initial '{letter}' with name '{new_full_name}'")
+            print(f"ID {row_id} already satisfies {reason} with name '{new_full_name}'")
+            continue
+
+        records[row_id - 1] = (new_full_name,) + record[1:]
+        del by_name[current_name]
+        by_name[new_full_name] = row_id - 1
+        changed += 1
+        print(f"Updated id {row_id}: '{current_name}' -> '{new_full_name}' ({reason})")
+
+    print("Applied name overrides.")
+    return changed
+
+def check_hidden_word(word):
+    # the word in upper case, if every letter is the initial of some last name
+    word = str(word).upper()
+    missing = sorted(set(word) - {ln[0] for ln in LAST_NAMES})
+    if not word or missing:
+        raise ValueError(f"hidden word {word!r}: no last names start with {', '.join(missing) or 'an empty word'}")
+    return word
+
+def hidden_word_overrides(records, suspect_ids, word):
+    """
+    {who.id: {"name": full_name}} overrides under which the suspects' last-name initials,
+    read in name order as part 2 asks, spell word. Suspects are taken in their current
+    name order; each gets the first free "First Last" with its letter's initial that sorts
+    after the previous suspect's new name, keeping its own first name where it can, so
+    first-name ties cannot reorder the letters. Raises ValueError if there are not exactly
+    len(word) suspects or a letter has no name left.
+    """
+    if len(suspect_ids) != len(word):
+        raise ValueError(f"{len(suspect_ids)} suspect(s) at the scene for the {len(word)}-letter word {word}")
+    taken = {record[0] for record in records}
+    by_initial = {}
+    for ln in sorted(LAST_NAMES):
+        by_initial.setdefault(ln[0], []).append(ln)
+    first_names = sorted(set(FIRST_NAMES))
+    overrides = {}
+    previous = ""
+    for row_id, letter in zip(sorted(suspect_ids, key=lambda i: records[i - 1][0]), word):
+        current = records[row_id - 1][0]
+        name = next((name for first in [current.split()[0], *first_names]
+                     for name in (f"{first} {ln}" for ln in by_initial[letter])
+                     if name > previous and (name == current or name not in taken)), None)
+        if name is None:
+            raise ValueError(f"no free name with initial {letter} sorts after {previous!r}")
+        taken.add(name)
+        overrides[row_id] = {"name": name}
+        previous = name
+    return overrides
+
+def spelled_word(records, suspect_ids):
+    # what part 2 reads: the suspects' last-name initials, sorted by name
+    return "".join(name.split()[-1][0] for name in sorted(records[i - 1][0] for i in suspect_ids))
+
+# --- Occupancy rollup (--occupancy) ---
+# per (city, time bucket) rollups for "who was in city C around time T", keyed so that
+# those queries are primary-key range lookups; each layout uses its own fly conventions
+# (compat: city label, ISO bucket start and SSN; optimized: city ID, epoch bucket start
+# and who.id)
+OCCUPANCY_SCHEMA = {
+    "compat": {
+        "counts": """
+            CREATE TABLE occupancy (
+                city TEXT NOT NULL,
+                hour TEXT NOT NULL,
+                present INTEGER NOT NULL,
+                PRIMARY KEY (city, hour)
+            ) WITHOUT ROWID;
+        """,
+        "agents": """
+            CREATE TABLE occupancy_agent (
+                city TEXT NOT NULL,
+                hour TEXT NOT NULL,
+                agent_ssn TEXT NOT NULL,
+                PRIMARY KEY (city, hour, agent_ssn)
+            ) WITHOUT ROWID;
+        """,
+    },
+    "optimized": {
+        "counts": """
+            CREATE TABLE occupancy (
+                city_id INTEGER NOT NULL REFERENCES city(id),
+                hour_epoch INTEGER NOT NULL,
+                present INTEGER NOT NULL,
+                PRIMARY KEY (city_id, hour_epoch)
+            ) WITHOUT ROWID;
+        """,
+        "agents": """
+            CREATE TABLE occupancy_agent (
+                city_id INTEGER NOT NULL REFERENCES city(id),
+                hour_epoch INTEGER NOT NULL,
+                agent_id INTEGER NOT NULL REFERENCES who(id),
+                PRIMARY KEY (city_id, hour_epoch, agent_id)
+            ) WITHOUT ROWID;
+        """,
+    },
+}
+HOUR_US = 3_600_000_000
+
+def occupancy_bucket_range(arr, dep, bucket_us, n_buckets):
+    # [first, last + 1) of the buckets since START that the stay [arr, dep) overlaps
+    lo = (arr - START_US) // bucket_us
+    hi = -((START_US - dep) // bucket_us)
+    return max(lo, 0), min(hi, n_buckets)
+
+def sweep_occupancy(stays, bucket_us):
+    """
+    Stays overlapping each (city, bucket), by a sweep line over the bucket boundaries:
+    every stay adds +1 at its first bucket and -1 after its last, and a running sum over
+    each city's boundaries gives the count, in O(stays + cities x buckets). stays are
+    (ssn, city_id, arrival_us, departure_us); yields (city_id, bucket, count) for the
+    non-zero buckets, ordered by city and bucket.
+    """
+    n_buckets = -((START_US - END_US) // bucket_us)
+    deltas = {}
+    for _, city, arr, dep in stays:
+        lo, hi = occupancy_bucket_range(arr, dep, bucket_us, n_buckets)
+        if lo >= hi:
             continue
+        delta = deltas.get(city)
+        if delta is None:
+            delta = deltas[city] = array("q", bytes(8 * (n_buckets + 1)))
+        delta[lo] += 1
+        delta[hi] -= 1
+    for city in sorted(deltas):
+        present = 0
+        for bucket, change in enumerate(islice(deltas[city], n_buckets)):
+            present += change
+            if present:
+                yield city, bucket, present
+
+def iter_occupancy_agents(stays, bucket_us):
+    # (city_id, bucket, ssn) for every bucket each stay overlaps, ordered like the primary key
+    n_buckets = -((START_US - END_US) // bucket_us)
+    by_city = {}
+    for ssn, city, arr, dep in stays:
+        by_city.setdefault(city, []).append((arr, dep, ssn))
+    for city in sorted(by_city):
+        rows = []
+        for arr, dep, ssn in by_city.pop(city):
+            lo, hi = occupancy_bucket_range(arr, dep, bucket_us, n_buckets)
+            rows.extend((bucket, ssn) for bucket in range(lo, hi))
+        rows.sort()
+        for bucket, ssn in rows:
+            yield city, bucket, ssn
+
+def write_occupancy_tables(cur, stays_for, layout, mode, bucket_hours, ids=None):
+    """
+    Build the --occupancy rollup from the in-memory stays: occupancy (stays present per
+    city and bucket) always, occupancy_agent (which agents) with mode "agents".
+    stays_for() returns a fresh iterable of (ssn, city_id, arrival_us, departure_us); ids
+    maps SSNs to who.id for the optimized layout's agent keys.
+    Returns (rows written, bytes added to the file).
+    """
+    bucket_us = int(bucket_hours * HOUR_US)
+    schema = OCCUPANCY_SCHEMA[layout]
+    if layout == "optimized":
+        def key(city, bucket):
+            return city, (START_US + bucket * bucket_us) // 1_000_000
+    else:
+        def key(city, bucket):
+            return CITY_LABELS[city], iso_utc_seconds((START_US + bucket * bucket_us) // 1_000_000)
+    page_size = cur.execute("PRAGMA page_size;").fetchone()[0]
+    pages_before = cur.execute("PRAGMA page_count;").fetchone()[0]
+
+    cur.execute(schema["counts"])
+    counts = sweep_occupancy(stays_for(), bucket_us)
+    rows = insert_chunked(cur, "INSERT INTO occupancy VALUES (?, ?, ?);",
+                          (key(city, bucket) + (present,) for city, bucket, present in counts))
+    if mode == "agents":
+        cur.execute(schema["agents"])
+        # an agent's overlapping stays (a generator defect the validator reports) would
+        # repeat a key
+        agents = iter_occupancy_agents(stays_for(), bucket_us)
+        agent = ids.__getitem__ if layout == "optimized" else str
+        rows += insert_chunked(cur, "INSERT OR IGNORE INTO occupancy_agent VALUES (?, ?, ?);",
+                               (key(city, bucket) + (agent(ssn),) for city, bucket, ssn in agents))
+    pages_after = cur.execute("PRAGMA page_count;").fetchone()[0]
+    return rows, (pages_after - pages_before) * page_size
+
+# --- Columnar export (--export) ---
+# column name and kind per exported table; "time" columns hold whole UTC seconds
+EXPORT_TABLES = {
+    "fly": [("agent_ssn", "str"), ("city", "str"), ("arrival_time", "time"), ("departure_time", "time")],
+    "who": [("id", "int"), ("name", "str"), ("ssn", "str"), ("height_cm", "int"), ("eye_color", "str"),
+            ("weight_kg", "int")],
+}
+EXPORT_FORMATS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+# rows per Arrow record batch / CSV write
+EXPORT_BATCH_ROWS = 65536
+
+class ColumnarExport:
+    """
+    Streams the fly and who tables into a directory as Parquet or Arrow IPC files
+    (pyarrow), or as CSV when pyarrow is missing, one record batch at a time. Rows are
+    taken from the same streams the SQLite writer consumes (see tee), so the export costs
+    no second pass over the data and never reads the finished database.
+    """
+
+    def __init__(self, out_dir, fmt="auto", batch_rows=EXPORT_BATCH_ROWS):
+        if fmt == "auto":
+            fmt = "parquet" if pa is not None else "csv"
+        if fmt != "csv" and pa is None:
+            raise RuntimeError(f"--export-format {fmt} requires pyarrow (pip install pyarrow)")
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.paths = {}
+        self._writers = {}
 
-        # Update DB
-        cur.execute("UPDATE who SET name = ? WHERE id = ?;", (new_full_name, row_id))
-        # Adjust in-memory tracking sets
-        existing_names.discard(current_name)
-        existing_names.add(new_full_name)
-        print(f"Updated id {row_id}: '{current_name}' -> '{new_full_name}' (initial {letter})")
+    def _open(self, table):
+        path = os.path.join(self.out_dir, table + EXPORT_FORMATS[self.fmt])
+        columns = EXPORT_TABLES[table]
+        if self.fmt == "csv":
+            f = open(path, "w", encoding="utf-8", newline="")
+            writer = csv.writer(f)
+            writer.writerow([name for name, _ in columns])
+            self._writers[table] = (f, writer)
+        else:
+            types = {"str": pa.string(), "int": pa.int64(), "time": pa.timestamp("s", tz="UTC")}
+            schema = pa.schema([(name, types[kind]) for name, kind in columns])
+            if self.fmt == "parquet":
+                writer = pq.ParquetWriter(path, schema)
+            else:
+                writer = pa.ipc.new_file(path, schema)
+            self._writers[table] = (schema, writer)
+        self.paths[table] = path
+
+    def write_batch(self, table, rows):
+        # rows: tuples in EXPORT_TABLES[table] order, epoch seconds in the "time" columns
+        if table not in self._writers:
+            self._open(table)
+        kinds = [kind for _, kind in EXPORT_TABLES[table]]
+        if self.fmt == "csv":
+            _, writer = self._writers[table]
+            times = [i for i, kind in enumerate(kinds) if kind == "time"]
+            for row in rows:
+                row = list(row)
+                for i in times:
+                    row[i] = iso_utc_seconds(row[i])
+                writer.writerow(row)
+            return
+        schema, writer = self._writers[table]
+        arrays = []
+        for field, kind, values in zip(schema, kinds, zip(*rows)):
+            if kind == "time":
+                arrays.append(pa.array(values, pa.int64()).cast(field.type))
+            else:
+                arrays.append(pa.array(values, field.type))
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+    def tee(self, table, rows, to_export=None):
+        # yield rows unchanged, exporting them (mapped through to_export) batch by batch
+        batch = []
+        for row in rows:
+            batch.append(to_export(row) if to_export else row)
+            if len(batch) >= self.batch_rows:
+                self.write_batch(table, batch)
+                batch = []
+            yield row
+        if batch:
+            self.write_batch(table, batch)
+
+    def write_rows(self, table, rows):
+        for _ in self.tee(table, rows):
+            pass
+
+    def close(self):
+        # CSV keeps (file, csv writer), pyarrow (schema, file writer)
+        for handle, writer in self._writers.values():
+            (handle if self.fmt == "csv" else writer).close()
+        self._writers = {}
+
+# --- Build cache ---
+def code_version():
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def config_fingerprint(args):
+    # everything except the SSN list that can change the generated data
+    config = {
+        "code": code_version(),
+        "seed": args.seed,
+        "engine": args.engine,
+        "rng": args.rng,
+        "ordering": args.ordering,
+        "placement": [args.placement, args.scenario_spec if args.placement == "solver" else None],
+        "layout": [args.layout, args.page_size if args.layout == "optimized" else None],
+        "occupancy": [args.occupancy, args.occupancy_hours if args.occupancy else None],
+        "window": [START.isoformat(), END.isoformat()],
+        "cities": CITIES,
+        "hops": HOP_NEIGHBOUR_COUNT,
+        "travel": [AVG_AIR_KMH, AIRPORT_OVERHEAD_HOURS],
+        "trips": [MAX_TRIPS_PER_AGENT, STAY_DAY_CHOICES, STAY_DAY_WEIGHTS, QUARTER_HOUR_MINUTES],
+        "jitter": [SORT_JITTER_HOURS_SD, SORT_JITTER_WINDOW_SDS],
+        "victim": [VICTIM_SSN, VICTIM_NAME, VICTIM_DEATH_UTC.isoformat(), MIN_OTHER_PRESENT, MAX_OTHER_PRESENT],
+        "overrides": [args.override_spec, args.hidden_word],
+        "names": [FIRST_NAMES, LAST_NAMES, EYE_COLORS, MIDDLE_INITIALS, NAME_SUFFIXES, NAME_TIERS],
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+def build_fingerprint(config_fp, ssns):
+    h = hashlib.sha256(config_fp.encode("utf-8"))
+    for ssn in ssns:
+        h.update(ssn.encode("utf-8") + b"\n")
+    return h.hexdigest()
+
+def cached_db_path(cache_dir, fingerprint):
+    return os.path.join(cache_dir, "db", f"{fingerprint}.sqlite")
 
-    conn.commit()
-    print("Applied last-name initial overrides.")
+def store_cached_db(cache_dir, fingerprint, db_path):
+    path = cached_db_path(cache_dir, fingerprint)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.copyfile(db_path, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    # keep only the most recently built artifacts
+    db_dir = os.path.dirname(path)
+    artifacts = sorted((os.path.join(db_dir, f) for f in os.listdir(db_dir) if f.endswith(".sqlite")),
+                       key=os.path.getmtime, reverse=True)
+    for stale in artifacts[CACHE_MAX_DBS:]:
+        os.remove(stale)
 
+def itinerary_fingerprint(seed):
+    # what a --rng per-agent itinerary depends on: the seed, catalog, travel model and the
+    # generator's own code. Layout, ordering, placement and the other build options only
+    # act on the stays afterwards, so toggling them keeps the cache.
+    code = [inspect.getsource(obj) for obj in (
+        haversine_km, travel_hours_between, TravelTable, generate_itinerary_for_agent, fallback_stays,
+        generate_agent_stays, derive_seed, agent_rng)]
+    config = {
+        "code": code,
+        "seed": seed,
+        "window": [START.isoformat(), END.isoformat()],
+        "cities": CITIES,
+        "hops": HOP_NEIGHBOUR_COUNT,
+        "travel": [AVG_AIR_KMH, AIRPORT_OVERHEAD_HOURS, EXACT_TRAVEL_MAX_CITIES, DENSE_TRAVEL_MAX_CITIES],
+        "trips": [MAX_TRIPS_PER_AGENT, STAY_DAY_CHOICES, STAY_DAY_WEIGHTS, QUARTER_HOUR_MINUTES],
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+def evict_itinerary_caches(cache_dir, keep=CACHE_MAX_ITINERARY_DBS):
+    caches = sorted((os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+                     if f.startswith("itineraries-") and f.endswith(".sqlite")),
+                    key=os.path.getmtime, reverse=True)
+    for stale in caches[keep:]:
+        os.remove(stale)
+
+def iter_cached_agent_itineraries(ssns, seed, workers, cache_dir):
+    """
+    --rng per-agent itineraries with a per-agent cache: an agent's stays depend only on
+    (itinerary_fingerprint, SSN), so only SSNs missing from the cache are generated.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"itineraries-{itinerary_fingerprint(seed)[:16]}.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS agent_stays (ssn TEXT PRIMARY KEY, stays BLOB NOT NULL);")
+    cached = {}
+    for i in range(0, len(ssns), 500):
+        chunk = ssns[i:i + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        for ssn, blob in conn.execute(f"SELECT ssn, stays FROM agent_stays WHERE ssn IN ({placeholders});", chunk):
+            cached[ssn] = pickle.loads(blob)
+    missing = [ssn for ssn in ssns if ssn not in cached]
+    print(f"Itinerary cache: {len(cached)} agent(s) cached, {len(missing)} to generate.")
+    fresh = dict(zip(missing, iter_per_agent_itineraries(missing, seed, workers)))
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO agent_stays (ssn, stays) VALUES (?, ?);",
+                         ((ssn, pickle.dumps(stays, protocol=pickle.HIGHEST_PROTOCOL)) for ssn, stays in fresh.items()))
     conn.close()
+    # a cache hit counts as use, so the caches still in rotation survive eviction
+    os.utime(path)
+    evict_itinerary_caches(cache_dir)
+    for ssn in ssns:
+        yield cached[ssn] if ssn in cached else fresh[ssn]
+
+# --- Incremental update (--update) ---
+# --rng per-agent builds carry a build_meta table; with it, --update patches the roster
+# difference into the existing file instead of regenerating it
+BUILD_META_SCHEMA = "CREATE TABLE IF NOT EXISTS build_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+# random draws per NAME_TIERS space when naming an added agent
+UPDATE_NAME_DRAWS = 64
+# SSNs per IN (...) list
+SQL_IN_CHUNK = 500
+
+def write_build_meta(cur, meta):
+    cur.execute(BUILD_META_SCHEMA)
+    cur.executemany("INSERT OR REPLACE INTO build_meta (key, value) VALUES (?, ?);",
+                    [(key, str(value)) for key, value in meta.items()])
+
+def read_build_meta(path):
+    # build_meta as a dict, or None for a file without one (not a --rng per-agent build)
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute("SELECT key, value FROM build_meta;"))
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
+
+def free_name(rng, taken):
+    # a random name not in taken, from the smallest space that still has room: plain
+    # FIRST_NAMES x LAST_NAMES first, as iter_unique_names, then each NAME_TIERS space
+    base = len(FIRST_NAMES) * len(LAST_NAMES)
+    for middle_options, suffix_options in [(1, 1), *NAME_TIERS]:
+        for _ in range(UPDATE_NAME_DRAWS):
+            name = compose_name(rng.randrange(base * middle_options * suffix_options), middle_options, suffix_options)
+            if name not in taken:
+                return name
+    raise ValueError("no free name left for a new agent")
+
+def avoid_death_city(stays, death_city, rng=random):
+    # an added agent's stays, regenerated with solve_agent_itinerary to keep out of
+    # death_city at the time of death if they would put it at the scene, so the agent never
+    # changes who is there and its stays still follow the travel and layover rules
+    if not any(city == death_city and arr <= VICTIM_DEATH_UTC < dep for city, arr, dep in stays):
+        return stays
+    entries = solve_agent_itinerary((), [(CITY_LABEL_INDEX[death_city], VICTIM_DEATH_UTC)], rng)
+    return [(CITY_LABELS[city], from_us(arr), from_us(dep)) for city, arr, dep in entries]
+
+def update_database(args, ssns, out_db):
+    """
+    --update: bring out_db to the roster ssns without regenerating it. Removed agents' fly
+    and who rows are deleted; added agents get their get_itinerary stays (regenerated out of
+    the death city at the time of death) and a fresh unique name with the usual per-agent
+    attributes. Everything runs in one transaction on a temp copy, which is then renamed
+    over out_db, so readers see either the old or the new file. Kept rows keep their IDs;
+    added rows come after them.
+
+    Returns False, with the reason printed, when a full build is needed instead: out_db
+    has no build_meta, it was built with a different seed, options, scenario or code, a
+    removed agent holds a name-override who.id, or too few agents would be left at the
+    scene.
+    """
+    started = time.perf_counter()
+    if args.export or args.occupancy:
+        print("--update: --export and --occupancy need a full build; rebuilding.")
+        return False
+    meta = read_build_meta(out_db) if os.path.exists(out_db) else None
+    if meta is None:
+        print(f"--update: {out_db} has no build metadata; rebuilding.")
+        return False
+    if meta.get("config") != config_fingerprint(args):
+        print("--update: seed, options, scenario or generator changed since the last build; rebuilding.")
+        return False
+
+    conn = sqlite3.connect(f"file:{out_db}?mode=ro", uri=True)
+    stored = conn.execute("SELECT id, ssn, name FROM who;").fetchall()
+    conn.close()
+    roster = set(ssns) | {VICTIM_SSN}
+    removed = [(row_id, ssn) for row_id, ssn, _ in stored if ssn not in roster]
+    known = {ssn for _, ssn, _ in stored}
+    added = [ssn for ssn in ssns if ssn not in known]
+    if not removed and not added:
+        print(f"--update: {out_db} already matches the roster.")
+        return True
+    pinned = sorted(row_id for row_id, _ in removed if row_id in args.override_spec)
+    if pinned:
+        print(f"--update: removed agents hold name-override who.id(s) {pinned}; rebuilding.")
+        return False
+
+    death_city = meta["death_city"]
+    death = iso_utc(VICTIM_DEATH_UTC)
+    taken = {name for _, _, name in stored}
+    stays = get_itineraries(added, args.seed, args.workers)
+    tmp_db = f"{out_db}.update-{os.getpid()}"
+    shutil.copyfile(out_db, tmp_db)
+    try:
+        conn = sqlite3.connect(tmp_db, isolation_level=None)
+        cur = conn.cursor()
+        cur.execute("BEGIN;")
+        gone = [ssn for _, ssn in removed]
+        for i in range(0, len(gone), SQL_IN_CHUNK):
+            chunk = gone[i:i + SQL_IN_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            if args.layout == "optimized":
+                cur.execute(f"DELETE FROM fly_stay WHERE agent_id IN (SELECT id FROM who WHERE ssn IN ({placeholders}));",
+                            chunk)
+            else:
+                cur.execute(f"DELETE FROM fly WHERE agent_ssn IN ({placeholders});", chunk)
+            cur.execute(f"DELETE FROM who WHERE ssn IN ({placeholders});", chunk)
+
+        # who first: the optimized layout's stays refer to the new who.id
+        who_rows = []
+        for ssn in added:
+            name = free_name(agent_rng(args.seed, ssn, "name"), taken)
+            taken.add(name)
+            who_rows.append((name, ssn, *who_attributes(agent_rng(args.seed, ssn, "who"))))
+        insert_chunked(cur, "INSERT INTO who (name, ssn, height_cm, eye_color, weight_kg) VALUES (?, ?, ?, ?, ?);",
+                       who_rows)
+
+        rows = ((ssn, city, arr, dep) for ssn in added
+                for city, arr, dep in avoid_death_city(stays[ssn], death_city, agent_rng(args.seed, ssn, "update")))
+        if args.layout == "optimized":
+            ids = {}
+            for i in range(0, len(added), SQL_IN_CHUNK):
+                chunk = added[i:i + SQL_IN_CHUNK]
+                ids.update((ssn, row_id) for row_id, ssn in cur.execute(
+                    f"SELECT id, ssn FROM who WHERE ssn IN ({', '.join('?' * len(chunk))});", chunk))
+            fly_count = insert_chunked(cur, "INSERT INTO fly_stay (agent_id, city_id, arrival_epoch, departure_epoch) "
+                                            "VALUES (?, ?, ?, ?);",
+                                       ((ids[ssn], CITY_LABEL_INDEX[city], int(arr.timestamp()), int(dep.timestamp()))
+                                        for ssn, city, arr, dep in rows))
+        else:
+            fly_count = insert_chunked(cur, "INSERT INTO fly (agent_ssn, city, arrival_time, departure_time) "
+                                            "VALUES (?, ?, ?, ?);",
+                                       ((ssn, city, iso_utc(arr), iso_utc(dep)) for ssn, city, arr, dep in rows))
+
+        present = cur.execute("SELECT COUNT(DISTINCT agent_ssn) FROM fly WHERE city = ? AND arrival_time <= ? "
+                              "AND ? < departure_time AND agent_ssn != ?;",
+                              (death_city, death, death, VICTIM_SSN)).fetchone()[0]
+        # added agents avoid the scene, so a hidden word only breaks if a suspect left
+        need = len(args.hidden_word) if args.hidden_word else MIN_OTHER_PRESENT
+        if present < need:
+            cur.execute("ROLLBACK;")
+            conn.close()
+            print(f"--update: only {present} agent(s) would be left at the scene "
+                  f"(need {need}); rebuilding.")
+            return False
+        write_build_meta(cur, {"updates": int(meta.get("updates", 0)) + 1})
+        cur.execute("COMMIT;")
+        conn.close()
+        if args.layout == "optimized":
+            finalize_optimized_db(tmp_db, args.page_size)
+        os.replace(tmp_db, out_db)
+    finally:
+        if os.path.exists(tmp_db):
+            os.remove(tmp_db)
+    print(f"Updated {out_db} in {time.perf_counter() - started:.2f}s: +{len(added)} agent(s) "
+          f"({fly_count} stays), -{len(removed)} agent(s); {present} agent(s) at the scene.")
+    return True
+
+# --- Main process ---
+BUILD_PHASES = ("load_ssns", "itineraries", "victim_placement", "ordering", "fly_insert", "occupancy",
+                "who", "name_overrides", "who_insert", "finalize")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the F.L.Y./W.H.O. SQLite puzzle database.")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python",
+                        help="itinerary engine (default: python, reproduces the committed dataset)")
+    parser.add_argument("--seed", type=int, default=RANDOM_SEED,
+                        help=f"random seed (default: {RANDOM_SEED})")
+    parser.add_argument("--ssns", metavar="PATH", default=JSON_PATH,
+                        help="JSON array of agent SSNs (default: scripts/agent_ssns.json)")
+    parser.add_argument("--synthetic", metavar="N", type=parse_count,
+                        help="use N synthetic SSNs (e.g. 250000 or 1m, deterministic per --seed) instead of --ssns")
+    parser.add_argument("--out", metavar="PATH", default=OUT_DB,
+                        help="database to write (default: static/data.sqlite)")
+    parser.add_argument("--cities", metavar="PATH",
+                        help="city/airport catalog (JSON or CSV) replacing the built-in CITIES")
+    parser.add_argument("--hops", choices=["uniform", "nearest"], default="uniform",
+                        help="next-city choice: any other city (default) or one of the nearest")
+    parser.add_argument("--hop-neighbours", type=int, default=DEFAULT_HOP_NEIGHBOURS,
+                        help=f"--hops nearest: candidate cities per hop (default: {DEFAULT_HOP_NEIGHBOURS})")
+    parser.add_argument("--rng", choices=["global", "per-agent"], default="global",
+                        help="one sequential random stream (default) or streams derived from (seed, SSN)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="--rng per-agent: processes generating agent shards (output does not depend on it)")
+    parser.add_argument("--ordering", choices=["sort", "stream"], default="sort",
+                        help="row interleaving: global jitter sort (default) or bounded streaming merge")
+    parser.add_argument("--order-window-mb", type=float, default=ORDER_WINDOW_MAX_BYTES / 2**20,
+                        help="--ordering stream: MiB of waiting rows held in memory before spilling runs to "
+                             f"disk (default: {ORDER_WINDOW_MAX_BYTES // 2**20})")
+    parser.add_argument("--layout", choices=["compat", "optimized"], default="compat",
+                        help="output layout: original tables (default) or city table, epochs, indexes, VACUUM")
+    parser.add_argument("--page-size", type=int, default=OPTIMIZED_PAGE_SIZE,
+                        help=f"--layout optimized: SQLite page size (default: {OPTIMIZED_PAGE_SIZE})")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="write SQLite on a dedicated thread fed through a bounded queue, overlapping "
+                             "row ordering, formatting and who generation with the inserts (same output)")
+    parser.add_argument("--occupancy", choices=["counts", "agents"],
+                        help="also build a per-city, per-time-bucket occupancy rollup: stays present "
+                             "(counts), plus which agents (agents)")
+    parser.add_argument("--occupancy-hours", type=float, default=1.0,
+                        help="--occupancy: bucket length in hours (default: 1)")
+    parser.add_argument("--placement", choices=["rejection", "solver"], default="rejection",
+                        help="victim/witness placement: legacy retry and presence balancing (default) "
+                             "or the one-pass scenario constraint solver")
+    parser.add_argument("--scenario", metavar="PATH",
+                        help="--placement solver: JSON scenario constraints (default: the victim scenario)")
+    parser.add_argument("--name-overrides", metavar="PATH",
+                        help="JSON {who.id: letter | {\"initial\": letter} | {\"name\": name}} "
+                             "replacing the built-in SEIDPREBW overrides")
+    parser.add_argument("--hidden-word", metavar="WORD",
+                        help="put exactly len(WORD) agents at the scene and rename them so their last-name "
+                             "initials, sorted by name, spell WORD (replaces the who.id overrides; "
+                             f"--variants default: {HIDDEN_WORD})")
+    parser.add_argument("--variants", metavar="SEEDS|PATH",
+                        help="batch mode: build one DB per seed (e.g. 1-200 or 3,7,9) or per entry of a JSON "
+                             "variants file, plus a manifest with each variant's answer key")
+    parser.add_argument("--variant-dir", default=os.path.join(SCRIPT_DIR, "variants"),
+                        help="--variants: output directory (default: scripts/variants)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="--variants: variants built in parallel (default: CPU count)")
+    parser.add_argument("--export", metavar="DIR",
+                        help="also stream the fly and who tables into DIR as columnar files")
+    parser.add_argument("--export-format", choices=["auto", *EXPORT_FORMATS], default="auto",
+                        help="--export: parquet, arrow (IPC) or csv (default: parquet with pyarrow, else csv)")
+    parser.add_argument("--shards", choices=["month", "city"],
+                        help="also split fly (and any occupancy rollup) into one database per arrival month "
+                             "or city, with who in a core shard, plus a manifest for partial loading")
+    parser.add_argument("--shard-dir", metavar="DIR",
+                        help="--shards: output directory (default: the output path without .sqlite, plus -shards)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="build cache directory (default: scripts/.gen_cache)")
+    parser.add_argument("--update", action="store_true",
+                        help="patch the roster difference into an existing --rng per-agent build "
+                             "(falls back to a full build when it cannot)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always regenerate; neither read nor write the build cache")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write per-phase metrics as JSON lines to PATH ('-' for stderr)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="track allocations with tracemalloc and report each phase's peak (slow)")
+    parser.add_argument("--profile-phase", action="append", default=[], choices=BUILD_PHASES, metavar="PHASE",
+                        help=f"run PHASE under cProfile and dump its stats; repeatable ({', '.join(BUILD_PHASES)})")
+    parser.add_argument("--profile-dir", default=".",
+                        help="--profile-phase: directory for the dumped stats (default: current directory)")
+    return parser.parse_args(argv)
+
+class CountingRandom(random.Random):
+    """
+    random.Random that counts its core draws (random() and getrandbits()). Every derived
+    method goes through one of the two, so the values match random.Random(seed) exactly.
+    """
+
+    def __init__(self, seed=None):
+        self.draws = 0
+        super().__init__(seed)
+
+    def random(self):
+        self.draws += 1
+        return super().random()
+
+    def getrandbits(self, k):
+        self.draws += 1
+        return super().getrandbits(k)
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+class BuildInstrumentation:
+    """
+    Per-phase metrics for a build. Each finished phase yields one record:
+
+        {"phase", "elapsed_s", "rows", "rng_draws", "sql_statements", "peak_rss_mb", "error"}
+
+    plus "traced_current_mb"/"traced_peak_mb" with trace_memory. Records are written as
+    JSON lines to `jsonl` (an open text file) and/or passed to `callback`, and always
+    kept in `records`.
+
+    - rows: rows the phase produced (stays, ordered rows, inserted records), or None.
+    - rng_draws: draws from the RNGs made by rng() -- every draw with --rng global, the
+      scenario stream with --rng per-agent (per-agent streams are not counted).
+    - sql_statements: statements run on connections passed to watch(); executemany counts
+      once per row.
+    - peak_rss_mb: process peak so far; traced_peak_mb is the phase's own tracemalloc peak.
+    - error: None, or the exception ("ValueError: ...") that ended the phase; the record
+      is written before the exception propagates.
+
+    Phases named in profile_phases run under cProfile; their stats are dumped to
+    profile_dir as <phase>.prof (plus a <phase>.txt summary), and with trace_memory the
+    top allocation sites of the phase go to <phase>.alloc.txt.
+    """
+
+    def __init__(self, jsonl=None, callback=None, trace_memory=False, profile_phases=(), profile_dir=".",
+                 count=None):
+        self.jsonl = jsonl
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.profile_phases = set(profile_phases)
+        self.profile_dir = profile_dir
+        self.records = []
+        self._rngs = []
+        self._statements = 0
+        self._rows = None
+        # timing alone is free; draw and statement counting only run when asked for, or
+        # by default when the records go somewhere
+        self.active = count if count is not None else (jsonl is not None or callback is not None)
+
+    def rng(self, seed):
+        # a random.Random for seed whose draws are counted while the instrumentation is active
+        if not self.active:
+            return random.Random(seed)
+        rng = CountingRandom(seed)
+        self._rngs.append(rng)
+        return rng
+
+    def watch(self, conn):
+        if self.active:
+            conn.set_trace_callback(self.count_statement)
+        return conn
+
+    def count_statement(self, _statement, n=1):
+        self._statements += n
+
+    def rows(self, n):
+        # rows produced by the current phase
+        self._rows = n
+
+    def _draws(self):
+        return sum(rng.draws for rng in self._rngs)
+
+    @contextmanager
+    def phase(self, name):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        profiler = None
+        if name in self.profile_phases:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self._rows = None
+        draws, statements = self._draws(), self._statements
+        started = time.perf_counter()
+        error = None
+        try:
+            yield self
+        except BaseException as e:
+            # the phase still gets its record, marked, and the exception goes on
+            error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            raise
+        finally:
+            self._finish(name, started, profiler, draws, statements, error)
+
+    def _finish(self, name, started, profiler, draws, statements, error):
+        elapsed = time.perf_counter() - started
+        if profiler is not None:
+            profiler.disable()
+            self._dump_profile(name, profiler)
+        record = {
+            "phase": name,
+            "elapsed_s": round(elapsed, 6),
+            "rows": self._rows,
+            "rng_draws": self._draws() - draws,
+            "sql_statements": self._statements - statements,
+            "peak_rss_mb": peak_rss_mb(),
+            "error": error,
+        }
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            record["traced_current_mb"] = current / 2**20
+            record["traced_peak_mb"] = peak / 2**20
+        self.records.append(record)
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(record) + "\n")
+            self.jsonl.flush()
+        if self.callback is not None:
+            self.callback(record)
+
+    def _dump_profile(self, name, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, name)
+        profiler.dump_stats(base + ".prof")
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+        if self.trace_memory:
+            with open(base + ".alloc.txt", "w", encoding="utf-8") as f:
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:40]:
+                    f.write(f"{stat}\n")
+        print(f"Profiled phase {name}: {base}.prof", file=sys.stderr)
+
+    def close(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self.jsonl not in (None, sys.stdout, sys.stderr):
+            self.jsonl.close()
+
+def make_instrumentation(args):
+    jsonl = None
+    if args.metrics == "-":
+        jsonl = sys.stderr
+    elif args.metrics:
+        jsonl = open(args.metrics, "w", encoding="utf-8")
+    return BuildInstrumentation(jsonl, trace_memory=args.trace_memory,
+                                profile_phases=args.profile_phase, profile_dir=args.profile_dir)
+
+def configure(args):
+    # validate option combinations and install the seed and city catalog they ask for
+    if args.engine == "numpy" and np is None:
+        print("--engine numpy requires numpy (pip install numpy)", file=sys.stderr)
+        sys.exit(1)
+    if args.rng == "per-agent" and args.engine != "python":
+        print("--rng per-agent is only supported with --engine python", file=sys.stderr)
+        sys.exit(1)
+    if args.workers > 1 and args.rng != "per-agent":
+        print("--workers needs --rng per-agent (the global stream is strictly sequential)", file=sys.stderr)
+        sys.exit(1)
+    if args.occupancy_hours <= 0:
+        print("--occupancy-hours must be positive", file=sys.stderr)
+        sys.exit(1)
+    if args.update and args.rng != "per-agent":
+        print("--update needs --rng per-agent (with the global stream, every agent depends on the roster)",
+              file=sys.stderr)
+        sys.exit(1)
+    if args.shards and args.variants:
+        print("--shards splits a single build; it cannot be combined with --variants", file=sys.stderr)
+        sys.exit(1)
+    if args.scenario and args.placement != "solver":
+        print("--scenario needs --placement solver", file=sys.stderr)
+        sys.exit(1)
+    try:
+        args.scenario_spec = load_scenario(args.scenario) if args.scenario else default_scenario()
+    except (OSError, ValueError) as e:
+        print(f"Error loading scenario: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.name_overrides and (args.hidden_word or args.variants):
+        print("--name-overrides pins fixed who.ids; --hidden-word and --variants rename each build's own suspects",
+              file=sys.stderr)
+        sys.exit(1)
+    try:
+        if args.hidden_word:
+            args.hidden_word = check_hidden_word(args.hidden_word)
+            args.override_spec = {}
+        else:
+            args.override_spec = load_name_overrides(args.name_overrides) if args.name_overrides else NAME_OVERRIDES
+    except (OSError, ValueError) as e:
+        print(f"Error loading name overrides: {e}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        args.variant_specs = parse_variants(args.variants) if args.variants else None
+    except (OSError, ValueError) as e:
+        print(f"Error reading variants: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.export_format in ("parquet", "arrow") and pa is None:
+        print(f"--export-format {args.export_format} requires pyarrow (pip install pyarrow)", file=sys.stderr)
+        sys.exit(1)
+    if args.cities or args.hops == "nearest":
+        try:
+            cities = load_city_catalog(args.cities) if args.cities else CITIES
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading city catalog: {e}", file=sys.stderr)
+            sys.exit(1)
+        set_city_catalog(cities, args.hop_neighbours if args.hops == "nearest" else 0)
+        print(f"Using {len(CITY_NAMES)} cities ({args.hops} hops).")
+
+def build_database(args, ssns, out_db, config_fp=None, instrumentation=None):
+    """
+    Generate the dataset for ssns and write it to out_db. instrumentation, if given, is a
+    BuildInstrumentation that records the phases itineraries, victim_placement, ordering,
+    fly_insert, occupancy (with --occupancy), who, name_overrides, who_insert and finalize.
+    """
+    inst = instrumentation or BuildInstrumentation()
+    max_attempts = 500
+    # scenario_rng drives death city, presence balancing, victim fallbacks, jitter and names;
+    # each build seeds its own stream, so nothing depends on the module-level random state
+    scenario_rng = inst.rng(args.seed)
+    attr_rng_for = None
+    if args.rng == "per-agent":
+        # every agent's stays and who attributes come from its own (seed, SSN) stream, so
+        # agents can be generated in any order, on any number of processes
+        scenario_rng = inst.rng(derive_seed(args.seed, "scenario"))
+        if args.no_cache:
+            itineraries = iter_per_agent_itineraries(ssns, args.seed, args.workers)
+        else:
+            itineraries = iter_cached_agent_itineraries(ssns, args.seed, args.workers, args.cache_dir)
+        victim_rng = agent_rng(args.seed, VICTIM_SSN)
+        victim_candidates = (generate_itinerary_for_agent(VICTIM_SSN, rng=victim_rng) for _ in range(max_attempts))
+        attr_rng_for = lambda ssn: agent_rng(args.seed, ssn, "who")
+    elif args.engine == "numpy":
+        np_rng = np.random.default_rng(args.seed)
+        itineraries = (itin or fallback_stays(scenario_rng) for itin in iter_numpy_itineraries(len(ssns), np_rng))
+        # victim candidates are drawn lazily, in small batches, after the placement passes
+        victim_candidates = iter_numpy_itineraries(max_attempts, np_rng, batch_agents=64)
+    else:
+        itineraries = (generate_agent_stays(ssn, scenario_rng) for ssn in ssns)
+        victim_candidates = (generate_itinerary_for_agent(VICTIM_SSN, rng=scenario_rng) for _ in range(max_attempts))
+
+    with inst.phase("itineraries"):
+        # The per-agent itineraries are the only full copy of the dataset; every later stage
+        # streams from them.
+        agent_itins = build_agent_itineraries(ssns, itineraries)
+        inst.rows(agent_itins.stay_count())
+
+    with inst.phase("victim_placement"):
+        # Choose a death city for the victim
+        death_city_name = scenario_rng.choice(CITY_NAMES)
+        death_city = CITY_INDEX[death_city_name]
+        print(f"Chosen death city: {CITY_LABELS[death_city]}")
+
+        presence = CityPresenceIndex(agent_itins)
+        if args.placement == "solver":
+            # a hidden word needs exactly one suspect per letter
+            scenario = with_scene_size(args.scenario_spec, len(args.hidden_word)) if args.hidden_word \
+                else args.scenario_spec
+            try:
+                solve_scenario(agent_itins, presence, resolve_scenario(scenario, death_city_name), scenario_rng)
+            except ValueError as e:
+                print(f"Scenario cannot be satisfied: {e}", file=sys.stderr)
+                sys.exit(1)
+        elif args.hidden_word:
+            balance_death_city_presence(agent_itins, presence, death_city, scenario_rng,
+                                        len(args.hidden_word), len(args.hidden_word))
+            place_victim(agent_itins, presence, death_city, victim_candidates, scenario_rng)
+        else:
+            balance_death_city_presence(agent_itins, presence, death_city, scenario_rng)
+            place_victim(agent_itins, presence, death_city, victim_candidates, scenario_rng)
+        inst.rows(len(agent_itins[VICTIM_SSN]))
+
+    with inst.phase("ordering"):
+        # preserve original ssns order, but append victim last
+        # (--ordering stream is lazy; its merge work is timed as part of fly_insert)
+        ssn_order = [s for s in ssns if s != VICTIM_SSN] + [VICTIM_SSN]
+        if args.ordering == "stream":
+            ordered_rows = streaming_jittered_order(agent_itins, ssn_order, int(args.order_window_mb * 2**20),
+                                                    scenario_rng)
+        else:
+            ordered_rows = jittered_row_order(agent_itins, ssn_order, scenario_rng)
+            inst.rows(agent_itins.stay_count())
+
+    # Create SQLite DB and stream everything into it inside a single transaction
+    if os.path.exists(out_db):
+        print(f"Overwriting existing {out_db}")
+        os.remove(out_db)
+
+    # the columnar export rides along on the same row streams as the inserts
+    export = ColumnarExport(args.export, args.export_format) if args.export else None
+    if export is not None:
+        ordered_rows = export.tee("fly", ordered_rows,
+                                  lambda r: (r[1], CITY_LABELS[r[2]], r[3] // 1_000_000, r[4] // 1_000_000))
+
+    with inst.phase("fly_insert"):
+        if args.pipeline:
+            # a writer thread owns the connection; up to finalize the phases only queue to
+            # it, so who generation and the name overrides run while it drains fly
+            conn = cur = WriterPipeline(out_db, inst.count_statement if inst.active else None)
+        else:
+            conn = inst.watch(open_build_db(out_db))
+            cur = conn.cursor()
+        if args.layout == "optimized":
+            count = write_optimized_fly_tables(cur, ordered_rows, agent_ids(agent_itins))
+        else:
+            count = write_fly_table(cur, iter_fly_insert_rows(ordered_rows))
+        del ordered_rows
+        inst.rows(count)
+    print(f"Inserted {count} flight records into {out_db}.")
+
+    if args.occupancy:
+        with inst.phase("occupancy"):
+            started = time.perf_counter()
+            rows, added = write_occupancy_tables(cur, lambda: iter_agent_rows(agent_itins, ssn_order), args.layout,
+                                                 args.occupancy, args.occupancy_hours, agent_ids(agent_itins))
+            inst.rows(rows)
+        print(f"Occupancy rollup ({args.occupancy}, {args.occupancy_hours:g}h buckets): {rows} rows, "
+              f"{added / 1e6:.2f} MB added, built in {time.perf_counter() - started:.2f}s.")
+
+    # --- Generate WHO table ---
+    with inst.phase("who"):
+        who_records = generate_who_records(list(agent_itins.keys()), scenario_rng, attr_rng_for)
+        inst.rows(len(who_records))
+
+    with inst.phase("name_overrides"):
+        # resolved on the records, so the table below goes in with one bulk insert
+        overrides = args.override_spec
+        if args.hidden_word:
+            ids = agent_ids(agent_itins)
+            suspect_ids = [ids[ssn] for ssn in presence.agents_present(death_city, VICTIM_DEATH_US)
+                           if ssn != VICTIM_SSN]
+            try:
+                overrides = hidden_word_overrides(who_records, suspect_ids, args.hidden_word)
+            except ValueError as e:
+                print(f"Cannot spell {args.hidden_word}: {e}", file=sys.stderr)
+                sys.exit(1)
+        inst.rows(apply_name_overrides(who_records, overrides))
+        if args.hidden_word and spelled_word(who_records, suspect_ids) != args.hidden_word:
+            print(f"Suspects spell {spelled_word(who_records, suspect_ids)}, not {args.hidden_word}", file=sys.stderr)
+            sys.exit(1)
+
+    with inst.phase("who_insert"):
+        if export is not None:
+            export.write_rows("who", ((row_id, *record) for row_id, record in enumerate(who_records, 1)))
+        count_who = write_who_table(cur, who_records)
+        del who_records
+        inst.rows(count_who)
+    print(f"Inserted {count_who} agent records into 'who' table.")
+
+    with inst.phase("finalize"):
+        # Secondary indexes go in after the bulk load, before the commit.
+        if args.layout == "optimized":
+            for statement in OPTIMIZED_FLY_INDEXES:
+                cur.execute(statement)
+        if args.rng == "per-agent":
+            # what --update needs to patch this file instead of rebuilding it
+            write_build_meta(cur, {"config": config_fp or config_fingerprint(args), "seed": args.seed,
+                                   "layout": args.layout, "death_city": CITY_LABELS[death_city], "updates": 0})
+        conn.execute("COMMIT;")
+        conn.close()
+        if args.pipeline:
+            print(f"Writer thread: {conn.writer_cpu_s:.2f}s CPU; the producer waited {conn.waited_s:.2f}s "
+                  f"on a full queue.")
+        if args.layout == "optimized":
+            finalize_optimized_db(out_db, args.page_size, inst.count_statement if inst.active else None)
+            print(f"Optimized layout: {os.path.getsize(out_db)} bytes at page size {args.page_size}.")
+        if export is not None:
+            export.close()
+            print(f"Exported {', '.join(export.paths.values())} ({export.fmt}).")
+
+def build_or_copy_cached(args, ssns, out_db, instrumentation=None):
+    # build out_db, or copy it from the build cache when the inputs are unchanged
+    config_fp = config_fingerprint(args)
+    fingerprint = build_fingerprint(config_fp, ssns)
+    # a cached DB comes without the --export files, so exports always rebuild
+    if not args.no_cache and not args.export and os.path.exists(cached_db_path(args.cache_dir, fingerprint)):
+        shutil.copyfile(cached_db_path(args.cache_dir, fingerprint), f"{out_db}.tmp-{os.getpid()}")
+        os.replace(f"{out_db}.tmp-{os.getpid()}", out_db)
+        print(f"Inputs unchanged (fingerprint {fingerprint[:12]}); copied cached build to {out_db}.")
+        return
+
+    # readers of out_db see the old file until the new one is complete
+    tmp_db = f"{out_db}.tmp-{os.getpid()}"
+    try:
+        print("Generating itineraries...")
+        build_database(args, ssns, tmp_db, config_fp, instrumentation)
+        os.replace(tmp_db, out_db)
+    finally:
+        if os.path.exists(tmp_db):
+            os.remove(tmp_db)
+    print(f"Wrote {out_db}.")
+    if not args.no_cache:
+        store_cached_db(args.cache_dir, fingerprint, out_db)
+
+# --- Sharded output (--shards) ---
+# per --layout: the tables that hold stays (copied row by row into the shard they belong
+# to), the tables copied whole into every shard, and per --shards mode the SQL for a stay's
+# shard key and its arrival/departure in epoch seconds
+# per layout: the stays table, the dimension tables its fly view reads (table -> filter on
+# the rows a shard copies, None for all), the stays' shard key and epoch times, and the
+# occupancy rollups' shard key and a (seekable where possible) predicate for one key
+SHARD_SOURCES = {
+    "compat": {
+        "stays": "fly", "dimensions": {},
+        "key": {"month": "substr(arrival_time, 1, 7)", "city": "city"},
+        "times": {"arrival": "CAST(strftime('%s', arrival_time) AS INTEGER)",
+                  "departure": "CAST(strftime('%s', departure_time) AS INTEGER)"},
+        "occupancy_key": {"month": "substr(hour, 1, 7)", "city": "city"},
+        "occupancy_where": {"month": "substr(hour, 1, 7) = ?", "city": "city = ?"},
+    },
+    "optimized": {
+        # a shard carries only the who rows its own stays refer to; core has the full table
+        "stays": "fly_stay", "dimensions": {"city": None, "who": "id IN (SELECT agent_id FROM shard.fly_stay)"},
+        "key": {"month": "strftime('%Y-%m', arrival_epoch, 'unixepoch')",
+                "city": "(SELECT label FROM city WHERE city.id = city_id)"},
+        "times": {"arrival": "arrival_epoch", "departure": "departure_epoch"},
+        "occupancy_key": {"month": "strftime('%Y-%m', hour_epoch, 'unixepoch')",
+                          "city": "(SELECT label FROM city WHERE city.id = city_id)"},
+        "occupancy_where": {"month": "strftime('%Y-%m', hour_epoch, 'unixepoch') = ?",
+                            "city": "city_id = (SELECT id FROM city WHERE label = ?)"},
+    },
+}
+OCCUPANCY_TABLES = ["occupancy", "occupancy_agent"]
+SHARD_CORE_FILE = "core.sqlite"
+
+def default_shard_dir(out_db):
+    # static/data.sqlite -> static/data-shards
+    return f"{os.path.splitext(out_db)[0]}-shards"
+
+def shard_file_name(key, taken):
+    slug = re.sub(r"[^a-z0-9]+", "-", key.lower()).strip("-") or "shard"
+    name, n = f"fly-{slug}.sqlite", 1
+    while name in taken:
+        n += 1
+        name = f"fly-{slug}-{n}.sqlite"
+    taken.add(name)
+    return name
+
+def file_summary(path):
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {"path": os.path.basename(path), "bytes": os.path.getsize(path), "sha256": digest}
+
+def write_core_shard(src_db, path, source):
+    """
+    Copy src_db to path without the stays and the occupancy rollups, which go into the
+    keyed shards: who, plus build_meta and the optimized layout's city table.
+    Returns {table: rows}.
+    """
+    shutil.copyfile(src_db, path)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN;")
+    if source["stays"] != "fly":
+        conn.execute("DROP VIEW fly;")
+    conn.execute(f"DROP TABLE {source['stays']};")
+    for table in OCCUPANCY_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {table};")
+    conn.execute("COMMIT;")
+    conn.execute("VACUUM;")
+    tables = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name;")]
+    rows = {name: conn.execute(f"SELECT COUNT(*) FROM {name};").fetchone()[0] for name in tables}
+    conn.close()
+    return rows
+
+def write_fly_shards(src_db, out_dir, layout, mode, page_size):
+    """
+    Split src_db's stays by mode ("month" of arrival, or "city") into one database per
+    key under out_dir, each with the layout's own fly schema, so a client can load just
+    the shards a query touches. Stays keep their fly IDs. Occupancy rollups, if built,
+    go into the shard of their bucket's month or city. Returns one manifest entry per
+    shard, in key order.
+    """
+    source = SHARD_SOURCES[layout]
+    stays = source["stays"]
+    conn = sqlite3.connect(f"file:{src_db}?mode=ro", uri=True, isolation_level=None)
+    occupancy = [name for (name,) in conn.execute(
+        f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({', '.join('?' * len(OCCUPANCY_TABLES))});",
+        OCCUPANCY_TABLES)]
+    # fly's own objects, minus SQLite's internal tables: created empty in every shard
+    tables = [stays, "fly", *source["dimensions"], *occupancy]
+    schema = conn.execute(
+        f"SELECT type, sql FROM sqlite_master WHERE tbl_name IN ({', '.join('?' * len(tables))}) "
+        "AND name NOT LIKE 'sqlite_%' AND sql IS NOT NULL ORDER BY rowid;", tables).fetchall()
+    # one pass over the stays; the keyed copy lives in the temp database, so src_db is untouched
+    times = source["times"]
+    conn.execute(f"CREATE TEMP TABLE shard_key AS SELECT {source['key'][mode]} AS key, id, "
+                 f"{times['arrival']} AS arrival, {times['departure']} AS departure FROM {stays};")
+    conn.execute("CREATE INDEX temp.shard_key_key ON shard_key (key, id);")
+    ranges = {row[0]: row[1:] for row in conn.execute(
+        "SELECT key, COUNT(*), MIN(id), MAX(id), MIN(arrival), MAX(arrival), MIN(departure), "
+        "MAX(departure) FROM shard_key GROUP BY key;")}
+    keys = set(ranges)
+    for table in occupancy:
+        keys.update(key for (key,) in conn.execute(f"SELECT DISTINCT {source['occupancy_key'][mode]} FROM {table};"))
+    columns = ", ".join(f"s.{row[1]}" for row in conn.execute(f"PRAGMA table_info({stays});"))
+
+    shards, taken = [], set()
+    for key in sorted(keys):
+        rows, first_id, last_id, first_arr, last_arr, first_dep, last_dep = ranges.get(key, (0,) + (None,) * 6)
+        path = os.path.join(out_dir, shard_file_name(key, taken))
+        conn.execute("ATTACH DATABASE ? AS shard;", (path,))
+        conn.execute("PRAGMA shard.journal_mode = OFF;")
+        conn.execute("PRAGMA shard.synchronous = OFF;")
+        conn.execute("BEGIN;")
+        # tables first, then the rows, then the indexes and views over them
+        for kind, sql in schema:
+            if kind == "table":
+                conn.execute(sql.replace("CREATE TABLE ", "CREATE TABLE shard.", 1))
+        conn.execute(f"INSERT INTO shard.{stays} SELECT {columns} FROM shard_key k JOIN main.{stays} s "
+                     "ON s.id = k.id WHERE k.key = ? ORDER BY k.id;", (key,))
+        for table, where in source["dimensions"].items():
+            conn.execute(f"INSERT INTO shard.{table} SELECT * FROM main.{table}"
+                         f"{f' WHERE {where}' if where else ''};")
+        for table in occupancy:
+            conn.execute(f"INSERT INTO shard.{table} SELECT * FROM main.{table} "
+                         f"WHERE {source['occupancy_where'][mode]};", (key,))
+        for kind, sql in schema:
+            if kind in ("index", "view"):
+                conn.execute(sql.replace(f"CREATE {kind.upper()} ", f"CREATE {kind.upper()} shard.", 1))
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM shard.{table};").fetchone()[0]
+                  for table in [*source["dimensions"], *occupancy]}
+        conn.execute("COMMIT;")
+        conn.execute("DETACH DATABASE shard;")
+        if layout == "optimized":
+            finalize_optimized_db(path, page_size)
+        shards.append({"key": key, **file_summary(path), "rows": rows, "ids": [first_id, last_id],
+                       "arrival": [iso_utc_seconds(first_arr) if rows else None,
+                                   iso_utc_seconds(last_arr) if rows else None],
+                       "departure": [iso_utc_seconds(first_dep) if rows else None,
+                                     iso_utc_seconds(last_dep) if rows else None],
+                       "tables": counts})
+    conn.close()
+    return shards
+
+def write_shards(src_db, shard_dir, layout, mode, page_size):
+    """
+    --shards: write src_db's stays and occupancy rollups split by mode, plus a core shard
+    with everything else (who above all), into shard_dir with a manifest.json giving each
+    shard's key, ID and time ranges, row counts, size and checksum. A month shard holds
+    the stays arriving in that month and the occupancy buckets starting in it; its
+    departure range shows how far the stays reach into later months. The directory is
+    built beside shard_dir and swapped in when complete.
+    """
+    tmp_dir = f"{shard_dir}.tmp-{os.getpid()}"
+    old_dir = f"{shard_dir}.old-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        core_path = os.path.join(tmp_dir, SHARD_CORE_FILE)
+        core_rows = write_core_shard(src_db, core_path, SHARD_SOURCES[layout])
+        manifest = {
+            "generated_utc": iso_utc(datetime.now(timezone.utc)),
+            "source": os.path.basename(src_db),
+            "layout": layout,
+            "partition": mode,
+            "core": {**file_summary(core_path), "rows": core_rows},
+            "shards": write_fly_shards(src_db, tmp_dir, layout, mode, page_size),
+        }
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+            f.write("\n")
+        if os.path.exists(shard_dir):
+            os.replace(shard_dir, old_dir)
+        os.replace(tmp_dir, shard_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+# --- Batch variants (--variants) ---
+def parse_variants(spec):
+    """
+    --variants value -> [{"name", "seed", "scenario", "word"}]. spec is a seed list and/or
+    ranges ("1-200", "7,11,20-25"), or a JSON file of {"seed", "name"?, "scenario"?, "word"?}
+    objects where scenario is a constraint list or a scenario file path (and implies
+    --placement solver) and word is that variant's hidden word.
+    """
+    if os.path.exists(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        if not isinstance(entries, list) or not all(isinstance(e, dict) and "seed" in e for e in entries):
+            raise ValueError("variants file must be a JSON array of objects with a seed")
+    else:
+        entries = []
+        for part in spec.split(","):
+            lo, _, hi = part.strip().partition("-")
+            entries.extend({"seed": seed} for seed in range(int(lo), int(hi or lo) + 1))
+    variants = []
+    for entry in entries:
+        scenario = entry.get("scenario")
+        if isinstance(scenario, str):
+            scenario = load_scenario(scenario)
+        word = entry.get("word")
+        variants.append({"name": str(entry.get("name", f"seed-{entry['seed']}")), "seed": int(entry["seed"]),
+                         "scenario": scenario, "word": check_hidden_word(word) if word is not None else None})
+    names = [v["name"] for v in variants]
+    if len(set(names)) != len(names):
+        raise ValueError("variant names must be unique")
+    return variants
+
+def answer_key(db_path):
+    # the puzzle answers as they ended up in a built database (either layout)
+    conn = sqlite3.connect(db_path)
+    death = iso_utc(VICTIM_DEATH_UTC)
+    row = conn.execute("SELECT city FROM fly WHERE agent_ssn = ? AND arrival_time <= ? AND ? < departure_time;",
+                       (VICTIM_SSN, death, death)).fetchone()
+    death_city = row[0] if row else None
+    suspects = conn.execute("""
+                            SELECT DISTINCT who.ssn, who.name
+                            FROM fly
+                                     JOIN who ON who.ssn = fly.agent_ssn
+                            WHERE fly.city = ? AND fly.arrival_time <= ? AND ? < fly.departure_time
+                              AND fly.agent_ssn != ?
+                            ORDER BY who.name;
+                            """, (death_city, death, death, VICTIM_SSN)).fetchall()
+    conn.close()
+    return {
+        "victim_ssn": VICTIM_SSN,
+        "death_time_utc": death,
+        "death_city": death_city,
+        "suspects": [{"ssn": ssn, "name": name} for ssn, name in suspects],
+        # part 2: the suspects' last-name initials in name order
+        "hidden_word": "".join(name.split()[-1][0] for _, name in suspects),
+    }
+
+_VARIANT_SSNS = None
+
+def _init_variant_worker(cities, hop_neighbours, ssns):
+    # pool initializer: the catalog tables and the SSN list are set up once per worker
+    global _VARIANT_SSNS
+    set_city_catalog(cities, hop_neighbours)
+    _VARIANT_SSNS = ssns
+
+def _build_variant(args, variant, out_dir):
+    # pool task: one variant's DB, its build log and its answer key
+    variant_args = argparse.Namespace(**vars(args))
+    # variants are built from scratch: their fingerprints all differ, and concurrent
+    # builds would only churn the shared cache
+    variant_args.no_cache = True
+    variant_args.seed = variant["seed"]
+    if args.export:
+        variant_args.export = os.path.join(args.export, variant["name"])
+    if variant["scenario"] is not None:
+        variant_args.placement, variant_args.scenario_spec = "solver", variant["scenario"]
+    # every variant has its own suspects; the fixed who.id overrides only fit the default seed
+    variant_args.hidden_word = variant["word"] or args.hidden_word or HIDDEN_WORD
+    variant_args.override_spec = {}
+    out_db = os.path.join(out_dir, f"{variant['name']}.sqlite")
+    if os.path.exists(out_db):
+        os.remove(out_db)
+    with open(os.path.join(out_dir, f"{variant['name']}.log"), "w", encoding="utf-8") as log, \
+            redirect_stdout(log):
+        build_database(variant_args, _VARIANT_SSNS, out_db)
+    answer = answer_key(out_db)
+    if answer["hidden_word"] != variant_args.hidden_word:
+        os.remove(out_db)
+        print(f"Variant {variant['name']}: suspects spell {answer['hidden_word']!r}, "
+              f"not {variant_args.hidden_word}", file=sys.stderr)
+        sys.exit(1)
+    with open(out_db, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {
+        "name": variant["name"],
+        "seed": variant["seed"],
+        "placement": variant_args.placement,
+        "scenario": variant_args.scenario_spec if variant_args.placement == "solver" else None,
+        "db": os.path.basename(out_db),
+        "sha256": digest,
+        "answer": answer,
+    }
+
+def build_variants(args, ssns):
+    """
+    Build every --variants entry into --variant-dir, --jobs at a time, then write
+    manifest.json with each variant's DB, checksum and answer key. The SSN list and the
+    catalog tables are set up once per worker and shared by all variants it builds.
+    """
+    os.makedirs(args.variant_dir, exist_ok=True)
+    variants = args.variant_specs
+    jobs = max(1, min(args.jobs, len(variants)))
+    if jobs > 1:
+        # variants already run in parallel; keep per-agent generation in-process
+        args.workers = 1
+    _init_variant_worker(CITIES, HOP_NEIGHBOUR_COUNT, ssns)
+    results = []
+    if jobs == 1:
+        tasks = map(_build_variant, repeat(args), variants, repeat(args.variant_dir))
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_variant_worker,
+                                   initargs=(CITIES, HOP_NEIGHBOUR_COUNT, ssns))
+        tasks = pool.map(_build_variant, repeat(args), variants, repeat(args.variant_dir))
+    try:
+        for result in tasks:
+            results.append(result)
+            answer = result["answer"]
+            print(f"[{len(results)}/{len(variants)}] {result['name']}: death city {answer['death_city']}, "
+                  f"{len(answer['suspects'])} suspect(s), word {answer['hidden_word']}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    manifest = {
+        "generated_utc": iso_utc(datetime.now(timezone.utc)),
+        "agents": len(ssns),
+        "options": {"engine": args.engine, "rng": args.rng, "ordering": args.ordering, "layout": args.layout,
+                    "placement": args.placement, "cities": len(CITY_NAMES), "hops": args.hops},
+        "variants": results,
+    }
+    manifest_path = os.path.join(args.variant_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    os.replace(manifest_path + ".tmp", manifest_path)
+    print(f"Wrote {len(results)} variant(s) and {manifest_path}.")
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure(args)
+    inst = make_instrumentation(args)
+
+    with inst.phase("load_ssns"):
+        try:
+            if args.synthetic is not None:
+                ssns = list(iter_synthetic_ssns(args.synthetic, args.seed))
+            else:
+                ssns = load_unique_ssns(args.ssns)
+        except Exception as e:
+            print(f"Error loading SSNs: {e}", file=sys.stderr)
+            sys.exit(1)
+        inst.rows(len(ssns))
+
+    if not ssns:
+        print("No SSNs found in JSON. Exiting.", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Found {len(ssns)} unique SSN(s).")
+
+    if args.variants:
+        build_variants(args, ssns)
+    elif not (args.update and update_database(args, ssns, args.out)):
+        build_or_copy_cached(args, ssns, args.out, inst)
+    if args.shards:
+        shard_dir = args.shard_dir or default_shard_dir(args.out)
+        manifest = write_shards(args.out, shard_dir, args.layout, args.shards, args.page_size)
+        print(f"Wrote {len(manifest['shards'])} {args.shards} shard(s) and a {manifest['core']['bytes']}-byte core "
+              f"shard to {shard_dir}.")
+    inst.close()
     print("Done.")
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+test_gen_sqlite_data.py
+
+Tests for gen_sqlite_data.py: the streaming roster reader (iter_json_array) and --update.
+
+Run from this directory with `python3 -m unittest test_gen_sqlite_data` (or pytest).
+Every document is read with chunk sizes from 1 byte up to the default, so each token
+gets split across a chunk boundary somewhere, and the items must match json.loads.
+--update is checked end to end: a build, an update adding synthetic agents, and
+validate_sqlite_data.py on the result, in both layouts.
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+import gen_sqlite_data as gen
+import validate_sqlite_data as validator
+
+# chunk sizes each document is read with
+CHUNK_SIZES = [*range(1, 17), 31, 64, gen.JSON_READ_CHUNK]
+# agents --update adds to the committed roster; enough that some land at the scene
+UPDATE_ADDED = 3000
+UPDATE_SSN_SEED = 99
+
+class IterJsonArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, text):
+        path = os.path.join(self.tmp.name, "roster.json")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def assertReadsLikeJson(self, text):
+        path = self.write(text)
+        expected = json.loads(text)
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(gen.iter_json_array(path, chunk_size)), expected)
+
+    def assertMalformed(self, text):
+        path = self.write(text)
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size), self.assertRaises(ValueError):
+                list(gen.iter_json_array(path, chunk_size))
+
+    def test_empty(self):
+        self.assertReadsLikeJson("[]")
+        self.assertReadsLikeJson(" \n[ \t\r\n]\n")
+
+    def test_strings(self):
+        self.assertReadsLikeJson(json.dumps([f"{i:03d}-{i % 100:02d}-{i:04d}" for i in range(500)]))
+        self.assertReadsLikeJson('[\n  "123-45-6789" ,\n\t"987-65-4321"\n]\n')
+
+    def test_escaped_strings(self):
+        self.assertReadsLikeJson(r'["a\"b", "c\\", "\\\"", "d,e", "[f]", "é中", "😀", "\n\t/"]')
+        self.assertReadsLikeJson(json.dumps(["é", "中文", '", "', "\\"], ensure_ascii=False))
+
+    def test_nested(self):
+        self.assertReadsLikeJson(json.dumps([{"ssn": "123-45-6789", "tags": ["a", {"b": [1, 2]}]},
+                                             [[], [[]], {}], "x", {"s": "]},["}]))
+
+    def test_scalars(self):
+        self.assertReadsLikeJson("[0, -7, 3.25, -7.5e3, 1E+2, 12345678901234567890, true, false, null, \"x\"]")
+        self.assertReadsLikeJson("[1]")
+        self.assertReadsLikeJson("[-0.5e-10]")
+
+    def test_strings_mixed_with_other_items(self):
+        # runs of strings are decoded in bulk; the items around them one at a time
+        self.assertReadsLikeJson('["a", "b", 1, "c", {"d": "e"}, "f", "g", [2], "h"]')
+
+    def test_not_an_array(self):
+        self.assertMalformed('{"ssns": []}')
+        self.assertMalformed('"123-45-6789"')
+        self.assertMalformed("")
+
+    def test_malformed(self):
+        self.assertMalformed('["a" "b"]')
+        self.assertMalformed('["a",]')
+        self.assertMalformed('["a", "b"')
+        self.assertMalformed('["a", "b')
+        self.assertMalformed('["a": 1]')
+        self.assertMalformed("[1, 2] 3")
+        self.assertMalformed('["a"]]')
+        self.assertMalformed("[tru]")
+        self.assertMalformed("[1.2.3]")
+
+@unittest.skipIf(validator.np is None, "validate_sqlite_data.py requires numpy")
+class UpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        with open(gen.JSON_PATH, encoding="utf-8") as f:
+            roster = json.load(f)
+        self.roster = os.path.join(self.tmp.name, "roster.json")
+        with open(self.roster, "w", encoding="utf-8") as f:
+            json.dump(roster + list(gen.iter_synthetic_ssns(UPDATE_ADDED, UPDATE_SSN_SEED)), f)
+
+    def generate(self, *args):
+        subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, "gen_sqlite_data.py"), "--no-cache", *args],
+                       check=True, stdout=subprocess.DEVNULL)
+
+    def test_update_then_validate(self):
+        for layout in ("compat", "optimized"):
+            with self.subTest(layout=layout):
+                db = os.path.join(self.tmp.name, f"{layout}.sqlite")
+                self.generate("--rng", "per-agent", "--layout", layout, "--out", db)
+                built = validator.validate(db)["who_rows"]
+                self.generate("--rng", "per-agent", "--layout", layout, "--out", db,
+                              "--update", "--ssns", self.roster)
+                report = validator.validate(db)
+                self.assertEqual(report["violations"], {})
+                self.assertEqual(report["who_rows"], built + UPDATE_ADDED)
+                conn = sqlite3.connect(db)
+                try:
+                    added = [name for (name,) in conn.execute("SELECT name FROM who WHERE id > ?;", (built,))]
+                finally:
+                    conn.close()
+                # plain first and last names while FIRST_NAMES x LAST_NAMES has room
+                self.assertTrue(all(len(name.split()) == 2 for name in added))
+
+if __name__ == "__main__":
+    unittest.main()
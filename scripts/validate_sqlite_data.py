@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+validate_sqlite_data.py
+
+Checks a database built by gen_sqlite_data.py (either --layout) against the invariants
+the generator's placement passes are meant to guarantee.
+
+Behavior:
+- Loads fly and who in bulk into NumPy columns, sorts the stays by (agent, arrival) once
+  and checks every invariant with vectorized comparisons between neighbouring rows:
+  - stays: every stay ends after it starts, an agent's stays never overlap, no agent stays
+    in the same city twice in a row, and each arrival comes at least the shortest plausible
+    trip after the previous departure (travel floor, minimum layover, arrival snapping);
+  - victim: VICTIM_SSN is in exactly one city at VICTIM_DEATH_UTC, with between
+    MIN_OTHER_PRESENT and MAX_OTHER_PRESENT other agents there (exactly --others N for
+    builds made with --hidden-word, N being the word's length);
+  - who: every agent in fly has exactly one who row, every who row has stays, and SSNs and
+    names are unique.
+- Prints every violated check with its fly/who row IDs (pairs for checks between two
+  stays) and exits 1 if anything was found; --json PATH writes the full report.
+- --cities PATH validates against the catalog the database was built with.
+- A path that is missing or not a generated database exits 1 with an error message.
+- Every check is expected to pass on any seed, engine and placement: the placement
+  passes regenerate the agents they move instead of patching their stays in place.
+- Requires numpy.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+import gen_sqlite_data as gen
+
+DEFAULT_DB = os.path.join(SCRIPT_DIR, "..", "static", "data.sqlite")
+# rows per fetchmany while loading a table
+FETCH_ROWS = 200_000
+# the generator's shortest hop: travel jitter at its minimum, the shortest layover, and an
+# arrival snapped back to the quarter hour (up to an hour earlier)
+MIN_TRAVEL_JITTER_HOURS = -0.5
+MIN_TRAVEL_HOURS = 0.5
+MIN_LAYOVER_HOURS = 2.0
+ARRIVAL_SNAP_HOURS = 1.0
+# row IDs printed per violated check; --json has all of them
+PRINT_ROWS = 10
+
+def fetch_columns(conn, sql, dtypes):
+    # run sql and return one NumPy array per selected column, loaded FETCH_ROWS at a time
+    cur = conn.execute(sql)
+    chunks = [[] for _ in dtypes]
+    while True:
+        rows = cur.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        for i, (chunk, dtype) in enumerate(zip(chunks, dtypes)):
+            chunk.append(np.array([row[i] for row in rows], dtype=dtype))
+    return [np.concatenate(chunk) if chunk else np.array([], dtype=dtype) for chunk, dtype in zip(chunks, dtypes)]
+
+def load_fly(conn):
+    # the optimized layout's view carries epoch columns; the compat table only ISO text,
+    # which NumPy parses once the trailing "Z" is cut off
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(fly);")}
+    if "arrival_epoch" in columns:
+        times, time_dtype = "arrival_epoch, departure_epoch", np.int64
+    else:
+        times, time_dtype = "substr(arrival_time, 1, 19), substr(departure_time, 1, 19)", "datetime64[s]"
+    ids, ssns, labels, arr, dep = fetch_columns(
+        conn, f"SELECT id, agent_ssn, city, {times} FROM fly;", [np.int64, np.str_, np.str_, time_dtype, time_dtype])
+    arr, dep = arr.astype(np.int64), dep.astype(np.int64)
+    # cities as catalog IDs (-1 when the label is not in the catalog)
+    names, inverse = np.unique(labels, return_inverse=True)
+    city_ids = np.array([gen.CITY_LABEL_INDEX.get(str(name), -1) for name in names], dtype=np.int64)
+    # agents as indexes into the sorted unique SSNs, so sorts and comparisons are on integers
+    agents, agent = np.unique(ssns, return_inverse=True)
+    return {"id": ids, "agents": agents, "agent": agent, "label": labels, "city": city_ids[inverse],
+            "arr": arr, "dep": dep}
+
+def load_who(conn):
+    ids, names, ssns = fetch_columns(conn, "SELECT id, name, ssn FROM who;", [np.int64, np.str_, np.str_])
+    return {"id": ids, "name": names, "ssn": ssns}
+
+def duplicated(values):
+    # mask of the entries whose value occurs more than once
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    return counts[inverse] > 1
+
+def check_stays(fly):
+    # sort once by (agent, arrival); every per-agent check compares row i with row i + 1
+    order = np.lexsort((fly["arr"], fly["agent"]))
+    ids, agent, city = fly["id"][order], fly["agent"][order], fly["city"][order]
+    arr, dep = fly["arr"][order], fly["dep"][order]
+    same_agent = agent[1:] == agent[:-1]
+    pairs = np.stack([ids[:-1], ids[1:]], axis=1)
+
+    overlap = same_agent & (arr[1:] < dep[:-1])
+    known = same_agent & ~overlap & (city[:-1] >= 0) & (city[1:] >= 0)
+    a, b = city[:-1][known], city[1:][known]
+    floor_h = np.maximum(MIN_TRAVEL_HOURS, gen.TRAVEL.hours_array(a, b) + MIN_TRAVEL_JITTER_HOURS) \
+        + MIN_LAYOVER_HOURS - ARRIVAL_SNAP_HOURS
+    too_fast = np.zeros_like(known)
+    too_fast[known] = (arr[1:] - dep[:-1])[known] < floor_h * 3600
+    return {
+        "unknown_city": ("city is not in the catalog", ids[city < 0]),
+        "empty_stay": ("departure is not after arrival", ids[dep <= arr]),
+        "overlapping_stays": ("stay starts before the agent's previous stay ends", pairs[overlap]),
+        "repeated_city": ("consecutive stays of an agent in the same city",
+                          pairs[same_agent & (city[1:] == city[:-1])]),
+        "implausible_travel": ("arrival is sooner after the previous departure than the shortest trip",
+                               pairs[too_fast]),
+    }
+
+def check_victim(fly, expected=None):
+    # expected: exact number of other agents at the scene, else MIN/MAX_OTHER_PRESENT
+    death = int(gen.VICTIM_DEATH_UTC.timestamp())
+    present = (fly["arr"] <= death) & (death < fly["dep"])
+    is_victim = fly["agent"] == np.searchsorted(fly["agents"], gen.VICTIM_SSN)
+    if gen.VICTIM_SSN not in fly["agents"]:
+        is_victim[:] = False
+    victim = present & is_victim
+    checks = {"victim_at_death": (f"{gen.VICTIM_SSN} must be in exactly one city at {gen.iso_utc(gen.VICTIM_DEATH_UTC)}",
+                                  fly["id"][victim] if victim.sum() != 1 else fly["id"][:0])}
+    death_cities = np.unique(fly["label"][victim])
+    others = present & ~is_victim & np.isin(fly["label"], death_cities)
+    count = len(np.unique(fly["agent"][others]))
+    lo, hi = (expected, expected) if expected is not None else (gen.MIN_OTHER_PRESENT, gen.MAX_OTHER_PRESENT)
+    in_range = lo <= count <= hi
+    checks["others_at_death"] = (
+        f"{count} other agent(s) with the victim, need {lo}-{hi}",
+        fly["id"][others] if not in_range or len(death_cities) != 1 else fly["id"][:0])
+    return checks, [str(c) for c in death_cities], count
+
+def check_who(fly, who):
+    agents = fly["agents"]
+    return {
+        "duplicate_ssn": ("SSN appears in more than one who row", who["id"][duplicated(who["ssn"])]),
+        "duplicate_name": ("name appears in more than one who row", who["id"][duplicated(who["name"])]),
+        "agent_without_who": ("fly agent has no who row",
+                              fly["id"][~np.isin(agents, who["ssn"])[fly["agent"]]]),
+        "who_without_stays": ("who row has no stays in fly", who["id"][~np.isin(who["ssn"], agents)]),
+    }
+
+def validate(db_path, expected_others=None):
+    # returns the report dict; report["violations"] maps check name -> description and row IDs.
+    # Raises sqlite3.DatabaseError if db_path is not a database with fly and who tables.
+    started = time.perf_counter()
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        fly, who = load_fly(conn), load_who(conn)
+    finally:
+        conn.close()
+    loaded = time.perf_counter()
+    victim_checks, death_cities, others = check_victim(fly, expected_others)
+    checks = {**check_stays(fly), **victim_checks, **check_who(fly, who)}
+    finished = time.perf_counter()
+    return {
+        "db": db_path,
+        "fly_rows": len(fly["id"]),
+        "who_rows": len(who["id"]),
+        "death_city": death_cities[0] if len(death_cities) == 1 else death_cities,
+        "others_at_death": others,
+        "load_s": loaded - started,
+        "check_s": finished - loaded,
+        "violations": {name: {"description": description, "rows": rows.tolist()}
+                       for name, (description, rows) in checks.items() if len(rows)},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check a generated F.L.Y./W.H.O. database against its invariants.")
+    parser.add_argument("db", nargs="?", default=DEFAULT_DB, help="database to check (default: ../static/data.sqlite)")
+    parser.add_argument("--cities", help="city catalog the database was built with (see gen_sqlite_data.py --cities)")
+    parser.add_argument("--json", help="write the full report, with every violating row ID, to this file")
+    parser.add_argument("--others", type=int, metavar="N",
+                        help="exact number of other agents at the scene (len(WORD) for --hidden-word builds)")
+    args = parser.parse_args(argv)
+    if np is None:
+        sys.exit("validate_sqlite_data.py requires numpy (pip install numpy)")
+    if args.cities:
+        gen.set_city_catalog(gen.load_city_catalog(args.cities))
+
+    if not os.path.isfile(args.db):
+        sys.exit(f"{args.db}: no such database")
+    try:
+        report = validate(args.db, args.others)
+    except sqlite3.DatabaseError as e:
+        sys.exit(f"{args.db}: not a generated database ({e})")
+    print(f"{report['db']}: {report['fly_rows']} stays, {report['who_rows']} agents, death city "
+          f"{report['death_city']} with {report['others_at_death']} others "
+          f"(loaded in {report['load_s']:.2f}s, checked in {report['check_s']:.2f}s)")
+    for name, violation in report["violations"].items():
+        rows = violation["rows"]
+        more = f" ... (+{len(rows) - PRINT_ROWS})" if len(rows) > PRINT_ROWS else ""
+        print(f"  {name}: {len(rows)} violation(s), {violation['description']}; rows {rows[:PRINT_ROWS]}{more}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if report["violations"]:
+        sys.exit(1)
+    print("All invariants hold.")
+
+if __name__ == "__main__":
+    main()